@@ -1,9 +1,152 @@
 from __future__ import annotations
 
+import base64
+import contextvars
+import hashlib
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from functools import partial
+from typing import Any
+from typing import NamedTuple
+from typing import TYPE_CHECKING
+
 import numpy as np
-import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.colors import get_colorscale
+from plotly.colors import qualitative
+from plotly.exceptions import PlotlyError
+
+if TYPE_CHECKING:
+    import asyncio
+
+
+# PhaseReport of the innermost profile_phases block, None outside of profile_phases
+current_report = contextvars.ContextVar('current_report', default=None)
+
+
+class PhaseReport:
+    """
+    Wall time and allocated bytes of the phases run inside profile_phases
+    Phases are detection, level_of_detail, grid, geometry, traces, layout, figure and serialization
+    """
+
+    def __init__(self, memory=False, callback=None):
+        self.memory = memory
+        self.callback = callback
+        self.records = []
+        self.running = False
+
+    def record(self, name, seconds, n_bytes):
+        """
+        Add the record of a phase and send it to the callback
+        """
+        record = {'phase': name, 'seconds': seconds, 'bytes': n_bytes}
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def totals(self) -> dict:
+        """
+        Number of calls, total time and total allocated bytes of every phase, in the order of their first run
+        Bytes are None when memory is not recorded
+        """
+        totals: dict[str, dict] = {}
+        for record in self.records:
+            total = totals.setdefault(
+                record['phase'], {'calls': 0, 'seconds': 0.0, 'bytes': 0 if self.memory else None},
+            )
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            if self.memory:
+                total['bytes'] += record['bytes']
+        return totals
+
+
+@contextmanager
+def profile_phases(memory=False, callback=None):
+    """
+    Record the phases of the charts built and serialized in the block
+    Example :
+        with profile_phases(memory=True) as report:
+            fig = plotly_bar_charts_3d(xdf, ydf, zdf)
+            with phase('serialization'):
+                fig.to_json()
+        print(report.totals())
+    :param memory: If True, also record the peak of memory allocated by every phase with tracemalloc, which
+                   slows the phases down
+    :param callback: Called with every record, a dict of phase, seconds and bytes, as soon as its phase ends
+    :return: PhaseReport filled while the block runs
+    """
+    report = PhaseReport(memory, callback)
+    start_tracing = memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    token = current_report.set(report)
+    try:
+        yield report
+    finally:
+        current_report.reset(token)
+        if start_tracing:
+            tracemalloc.stop()
+
+
+@contextmanager
+def phase(name):
+    """
+    Record the block, or the decorated function, as the phase name of the current profile_phases
+    Nothing is recorded outside of profile_phases, and phases run inside another phase are part of it
+    """
+    report = current_report.get()
+    if report is None or report.running:
+        yield
+        return
+
+    report.running = True
+    if report.memory:
+        tracemalloc.reset_peak()
+        start_bytes = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        n_bytes = tracemalloc.get_traced_memory()[1] - start_bytes if report.memory else None
+        report.running = False
+        report.record(name, seconds, n_bytes)
+
+
+# Corners of the unit box, 0 for the lower bound and 1 for the upper bound of each axis, in the vertex order of a bar
+UNIT_BOX_VERTICES = np.array(
+    [
+        [0, 0, 0],
+        [0, 1, 0],
+        [1, 1, 0],
+        [1, 0, 0],
+        [0, 0, 1],
+        [0, 1, 1],
+        [1, 1, 1],
+        [1, 0, 1],
+    ],
+    dtype=bool,
+)
+# The 12 triangles (i, j, k) of a bar, as indices of its 8 vertices
+BOX_FACES = np.array(
+    [
+        [7, 0, 0, 0, 4, 4, 6, 6, 4, 0, 3, 2],
+        [3, 4, 1, 2, 5, 6, 5, 2, 0, 1, 6, 3],
+        [0, 7, 2, 3, 6, 7, 1, 1, 5, 5, 7, 6],
+    ],
+    dtype=np.int32,
+).T
+UNIT_BOX_VERTICES.flags.writeable = False
+BOX_FACES.flags.writeable = False
 
 
 def generate_mesh(
@@ -18,41 +161,80 @@ def generate_mesh(
     hover_info,
     opacity: float = 1,
 ):
-    return go.Mesh3d(
-        x=[
-            x_min,
-            x_min,
-            x_max,
-            x_max,
-            x_min,
-            x_min,
-            x_max,
-            x_max,
-        ],
-        y=[
-            y_min,
-            y_max,
-            y_max,
-            y_min,
-            y_min,
-            y_max,
-            y_max,
-            y_min,
-        ],
-        z=[
-            z_min,
-            z_min,
-            z_min,
-            z_min,
-            z_max,
-            z_max,
-            z_max,
-            z_max,
-        ],
+    vertices, faces = box_geometry(x_min, x_max, y_min, y_max, z_min, z_max)
+    return mesh_from_geometry(vertices, faces, color_value, flat_shading, hover_info, opacity)
+
+
+@phase('geometry')
+def box_geometry(x_min, x_max, y_min, y_max, z_min, z_max):
+    """
+    Compute the vertices and the triangles of several boxes at once from UNIT_BOX_VERTICES and BOX_FACES
+    Every bound is an array with one value per box, scalars are broadcast
+    Each corner takes the lower or the upper bound of the box instead of lower + offset * size, so the
+    vertices are exactly the given bounds
+    :return: (n_boxes * 8, 3) array of vertices and (n_boxes * 12, 3) array of triangles
+    """
+    x_min, x_max, y_min, y_max, z_min, z_max = np.broadcast_arrays(
+        *(np.asarray(bound, dtype=float) for bound in (x_min, x_max, y_min, y_max, z_min, z_max)),
+    )
+    lower = np.stack((x_min.ravel(), y_min.ravel(), z_min.ravel()), axis=-1)
+    upper = np.stack((x_max.ravel(), y_max.ravel(), z_max.ravel()), axis=-1)
+    n_boxes = len(lower)
+
+    vertices = np.where(UNIT_BOX_VERTICES, upper[:, np.newaxis, :], lower[:, np.newaxis, :])
+    faces = BOX_FACES + 8 * np.arange(n_boxes, dtype=np.int32)[:, np.newaxis, np.newaxis]
+
+    return vertices.reshape(-1, 3), faces.reshape(-1, 3)
+
+
+@phase('geometry')
+def grid_geometry(z_grid, x_min=0, y_min=0, z_min=0, step=1):
+    """
+    Compute the vertices and the triangles of the bars of a grid in a few array operations
+    :param z_grid: 2D array, z_grid[i, j] is the height of the bar at the i-th x position and the j-th
+                   y position, NaN for a bar without value
+    :param x_min: Starting position for x-axis
+    :param y_min: Starting position for y-axis
+    :param z_min: Minimum value of the bars
+    :param step: Width of a bar, two bars are separated by step
+    :return: same as box_geometry, bars are ordered by y position then x position (z_grid.ravel('F'))
+    """
+    z_grid = np.asarray(z_grid, dtype=float)
+    len_x, len_y = z_grid.shape
+
+    x_start = np.tile(x_min + 2 * step * np.arange(len_x), len_y)
+    y_start = np.repeat(y_min + 2 * step * np.arange(len_y), len_x)
+
+    return box_geometry(
+        x_start,
+        x_start + step,
+        y_start,
+        y_start + step,
+        z_min,
+        z_grid.ravel(order='F'),
+    )
+
+
+def mesh_dict(
+    vertices,
+    faces,
+    color_value,
+    flat_shading,
+    hover_info,
+    opacity: float = 1,
+) -> dict:
+    """
+    Mesh3d trace as a plain dict, from vertices and faces arrays as returned by box_geometry
+    """
+    return dict(
+        type='mesh3d',
+        x=vertices[:, 0],
+        y=vertices[:, 1],
+        z=vertices[:, 2],
         color=color_value,
-        i=[7, 0, 0, 0, 4, 4, 6, 6, 4, 0, 3, 2],
-        j=[3, 4, 1, 2, 5, 6, 5, 2, 0, 1, 6, 3],
-        k=[0, 7, 2, 3, 6, 7, 1, 1, 5, 5, 7, 6],
+        i=faces[:, 0],
+        j=faces[:, 1],
+        k=faces[:, 2],
         opacity=opacity,
         flatshading=flat_shading,
         hovertext='text',
@@ -60,22 +242,172 @@ def generate_mesh(
     )
 
 
-def create_z_grid(len_x_df_uniq, len_y_df_uniq, z_df):
-    z_temp_df = []
-    z_index = 0
+def mesh_from_geometry(
+    vertices,
+    faces,
+    color_value,
+    flat_shading,
+    hover_info,
+    opacity: float = 1,
+):
+    """
+    Create a Mesh3d from vertices and faces arrays as returned by box_geometry
+    """
+    return go.Mesh3d(mesh_dict(vertices, faces, color_value, flat_shading, hover_info, opacity))
 
-    for y in range(len_y_df_uniq):
-        for x in range(len_x_df_uniq):
-            if z_index < len(z_df):
-                z_temp_df.append(z_df[z_index])
-                z_index += 1
-            else:
-                z_temp_df.append(None)
-    return z_temp_df
 
+@lru_cache(maxsize=None)
+def named_palette(name) -> tuple:
+    """
+    Colors of a plotly.colors.qualitative palette, such as Plotly, D3 or Set1, looked up once per name
+    """
+    colors = getattr(qualitative, name, None)
+    if not isinstance(colors, list):
+        raise ValueError(f'Unknown palette {name!r}, expected a name of plotly.colors.qualitative or a list of colors')
+    return tuple(colors)
 
-def figure_layout(
-    fig: go.Figure,
+
+@lru_cache(maxsize=None)
+def named_colorscale(name) -> tuple:
+    """
+    [position, color] pairs of a plotly colorscale, such as Viridis or Blues_r, looked up once per name
+    """
+    try:
+        return tuple(tuple(pair) for pair in get_colorscale(name))
+    except PlotlyError as error:
+        raise ValueError(f'Unknown colorscale {name!r}') from error
+
+
+@phase('geometry')
+def bar_colors(color, x_index, y_index, stride=None, palette='Plotly'):
+    """
+    Find the color of every bar
+    :param color: Axis to create color, x, y or x+y, z for colors given by the heights with height_intensity
+    :param x_index: Index of the x position of every bar
+    :param y_index: Index of the y position of every bar
+    :param stride: x+y colors are x_index + y_index * stride for bars on a grid, None for bars in any order
+                   colored in turn
+    :param palette: Name of a plotly.colors.qualitative palette or list of colors, cycled through
+    :return: palette and index in the palette of every bar
+    """
+    n_bars = len(x_index)
+    if color == 'z':
+        return [None], np.zeros(n_bars, dtype=int)
+    palette = named_palette(palette) if isinstance(palette, str) else palette
+    if color == 'x+y' and stride is not None and stride % len(palette) == 0:
+        # Bars next to each other along y would get the same color as along x
+        stride += max(len(palette) // 2, 1)
+    color_index = {
+        'x': x_index,
+        'y': y_index,
+        'x+y': np.arange(n_bars) if stride is None else np.asarray(x_index) + np.asarray(y_index) * stride,
+    }.get(color)
+    if color_index is None:
+        return [0], np.zeros(n_bars, dtype=int)
+    return palette, np.asarray(color_index) % len(palette)
+
+
+def height_intensity(trace_z):
+    """
+    Mesh3d intensity coloring every bar of a trace by its height, the z of its top vertices
+    :param trace_z: z of the vertices of the trace, 8 per bar
+    """
+    return np.repeat(np.asarray(trace_z)[4::8], 8)
+
+
+class Bars(NamedTuple):
+    """
+    Bars of a chart, in drawing order
+    vertices: (n_bars * 8, 3) array of vertices as returned by box_geometry
+    faces: (n_bars * 12, 3) array of triangles as returned by box_geometry
+    palette: list of colors
+    color_index: index in palette of the color of every bar
+    opacity: opacity of every bar
+    z_index: index in the flattened z values of the height of every bar, -1 for a bar without value
+    """
+    vertices: np.ndarray
+    faces: np.ndarray
+    palette: list
+    color_index: np.ndarray
+    opacity: np.ndarray
+    z_index: np.ndarray
+
+
+def group_bars(color_index, opacity, merge_traces=False):
+    """
+    Split the bars in traces
+    :param color_index: index in the palette of the color of every bar
+    :param opacity: opacity of every bar
+    :param merge_traces: If True, bars sharing the same color and opacity are in the same trace,
+                         else every bar has its own trace
+    :return: list of arrays of bar indexes, one per trace
+    """
+    if not merge_traces:
+        return np.arange(len(color_index))[:, np.newaxis]
+
+    # Stable sort keeps the bars of a group in their original order
+    order = np.lexsort((opacity, color_index))
+    keys = np.stack([color_index[order], opacity[order]])
+    groups = np.split(order, np.flatnonzero(np.any(np.diff(keys, axis=1), axis=0)) + 1)
+    return [group for group in groups if len(group)]
+
+
+@phase('traces')
+def mesh_dicts(bars: Bars, flat_shading, hover_info, merge_traces=False, colorscale=None):
+    """
+    Mesh3d traces of the bars as plain dicts
+    :param bars: Bars to draw
+    :param flat_shading:
+    :param hover_info: Hover info
+    :param merge_traces: If True, bars sharing the same color and opacity are drawn in a single Mesh3d
+                         instead of one Mesh3d per bar
+    :param colorscale: If not None, bars are colored by their height along this colorscale, name or list of
+                       colors, instead of by their palette
+    :return: list of dicts, go.Mesh3d(trace) validates a trace
+    """
+    vertices = bars.vertices.reshape(-1, 8, 3)
+
+    traces = [
+        mesh_dict(
+            vertices[group].reshape(-1, 3),
+            bars.faces[:12 * len(group)],
+            bars.palette[bars.color_index[group[0]]],
+            flat_shading,
+            hover_info,
+            opacity=float(bars.opacity[group[0]]),
+        )
+        for group in group_bars(bars.color_index, bars.opacity, merge_traces)
+    ]
+
+    if colorscale is not None:
+        # Colors are computed by plotly.js from the intensity, every trace shares the range of all the heights
+        heights = vertices[:, 4, 2]
+        colorscale = named_colorscale(colorscale) if isinstance(colorscale, str) else colorscale
+        for index, trace in enumerate(traces):
+            del trace['color']
+            trace.update(
+                intensity=height_intensity(trace['z']),
+                colorscale=colorscale,
+                cmin=float(np.nanmin(heights)),
+                cmax=float(np.nanmax(heights)),
+                showscale=index == 0,
+            )
+    return traces
+
+
+@phase('grid')
+def create_z_grid(len_x_df_uniq, len_y_df_uniq, z_df):
+    """
+    Arrange z values in a (len_y_df_uniq, len_x_df_uniq) grid, padded with NaN if values are missing
+    """
+    z_grid = np.full(len_x_df_uniq * len_y_df_uniq, np.nan)
+    z_df = np.asarray(z_df, dtype=float)[:z_grid.size]
+    z_grid[:z_df.size] = z_df
+    return z_grid.reshape(len_y_df_uniq, len_x_df_uniq)
+
+
+@phase('layout')
+def layout_dict(
     x_legend: str,
     y_legend,
     x_min,
@@ -86,42 +418,120 @@ def figure_layout(
     z_legend,
     z_title,
     title,
-):
+) -> dict:
+    """
+    Layout of the figure as a plain dict, see figure_layout
+    """
     y_min = 0
 
-    fig.update_layout(
+    layout: dict[str, Any] = dict(
         scene=dict(
             xaxis=dict(
                 tickmode='array',
                 ticktext=x_legend,
                 tickvals=np.arange(x_min, len_x_df_uniq * 2, step=2),
-                title=x_title,
+                title=dict(text=x_title),
             ),
             yaxis=dict(
                 tickmode='array',
                 ticktext=y_legend,
                 tickvals=np.arange(y_min, len_y_df_uniq * 2, step=2),
-                title=y_title,
+                title=dict(text=y_title),
             ),
-            zaxis=dict(title=z_title),
+            zaxis=dict(title=dict(text=z_title)),
         ),
+        title=dict(text=title),
     )
     if z_legend is None:
-        fig.update_layout(
-            scene=dict(
-                zaxis=dict(
-                    tickmode='array',
-                    ticktext=z_legend,
-                    title=z_title,
-                ),
-            ),
-            template='plotly_white',
-        )
-    fig.update_layout(title=title)
+        layout['scene']['zaxis'].update(tickmode='array', ticktext=z_legend)
+        layout['template'] = 'plotly_white'
+
+    return layout
+
+
+def figure_layout(
+    fig: go.Figure,
+    x_legend: str,
+    y_legend,
+    x_min,
+    len_x_df_uniq,
+    x_title,
+    y_title,
+    len_y_df_uniq,
+    z_legend,
+    z_title,
+    title,
+):
+    fig.update_layout(
+        layout_dict(
+            x_legend,
+            y_legend,
+            x_min,
+            len_x_df_uniq,
+            x_title,
+            y_title,
+            len_y_df_uniq,
+            z_legend,
+            z_title,
+            title,
+        ),
+    )
 
     return fig
 
 
+@phase('figure')
+def build_figure(data, layout, output='figure'):
+    """
+    Assemble the traces and the layout
+    :param data: list of traces as plain dicts
+    :param layout: layout as a plain dict
+    :param output: 'figure' for a go.Figure, validated once here, or 'dict' for the plain
+                   {'data': ..., 'layout': ...} dict without any validation
+    """
+    if output == 'dict':
+        template = layout.get('template', pio.templates.default)
+        if isinstance(template, str):
+            # go.Figure resolves the name of a template, plotly.js needs the template itself
+            layout['template'] = pio.templates[template].to_plotly_json()
+        return dict(data=data, layout=layout)
+    if output == 'figure':
+        return go.Figure(dict(data=data, layout=layout))
+    raise ValueError(f'Unknown output {output}, expected figure or dict')
+
+
+def cull_hidden_faces(fig) -> dict:
+    """
+    Remove the triangles of the bars that are never seen, in place
+    Bars are drawn with a gap of step between them, so a side face is never hidden by a neighbour, but the
+    bottom faces lie flat on z_min under the bars, the side faces of a bar whose height is z_min have no area
+    and the faces of a bar without value (NaN height) are not drawn by plotly.js
+    The face on z_min of a bar going below z_min is its visible cap and is kept
+    Top faces are kept, the cull has to be done again after changing the heights, see BarChart3D
+    :param fig: go.Figure or dict figure (output='dict') of plotly_bar_charts_3d
+    :return: dict with the number of triangles before the cull, of visible triangles kept, and their ratio
+    """
+    before = after = 0
+    for trace in fig['data']:
+        if trace['type'] != 'mesh3d':
+            continue
+        z = np.asarray(trace['z'], dtype=float)
+        faces = np.column_stack([np.asarray(trace[key]) for key in 'ijk'])
+
+        face_z = z[faces]
+        top = (faces % 8 >= 4).all(axis=1)
+        flat = (face_z == face_z[:, :1]).all(axis=1)
+        below = z[faces[:, 0] // 8 * 8 + 4] < face_z[:, 0]
+        visible = np.isfinite(face_z).all(axis=1) & (top | ~flat | below)
+        faces = faces[visible]
+
+        trace.update(i=faces[:, 0], j=faces[:, 1], k=faces[:, 2])
+        before += len(visible)
+        after += len(faces)
+
+    return {'triangles': before, 'visible_triangles': after, 'ratio': after / before if before else 1.0}
+
+
 def bar_charts_from_sparse_array(
     x_df,
     y_df,
@@ -140,6 +550,11 @@ def bar_charts_from_sparse_array(
     z_title='',
     hover_info='z',
     title='',
+    merge_traces=False,
+    return_bars=False,
+    output='figure',
+    palette='Plotly',
+    colorscale='Viridis',
 ) -> go.Figure:
     """
     Convert a dataframe in 3D barchart similar to matplotlib ones
@@ -161,6 +576,7 @@ def bar_charts_from_sparse_array(
     x for a different color for each change of x
     y for a different color for each change of y
     or x+y to get a different color for each bar
+    or z to color every bar by its height along colorscale
     :param x_legend: Legend of x-axis, if set to auto the legend is based on x_df
     :param y_legend: Legend of y-axis, if set to auto the legend is based on y_df
     :param z_legend: Legend of z axis, if set to auto the legend is not shown
@@ -170,71 +586,38 @@ def bar_charts_from_sparse_array(
     :param z_title: Title of z axis
     :param hover_info: Hover info, z by default
     :param title: Title of the graph, not functional for the moment
+    :param merge_traces: If True, draw all the bars sharing a color in a single Mesh3d instead of one
+                         Mesh3d per bar, much faster to build and render for big grids
+    :param return_bars: If True, return the Bars drawn along with the figure
+    :param output: 'figure' for a go.Figure or 'dict' for a plain dict built without plotly validation
+    :param palette: Colors of x, y and x+y, name of a plotly.colors.qualitative palette or list of colors
+    :param colorscale: Colors of z, name of a plotly colorscale or list of colors
     :return: 3D mesh figure acting as 3D bar charts
     """
-    z_df = list(pd.Series(z_df))
+    z_df = np.array(list(z_df), dtype=float)
 
     if z_min == 'auto':
-        z_min = 0.8 * min(z_df)
-
-    mesh_list = []
-    colors = px.colors.qualitative.Plotly
-    color_value = 0
+        z_min = 0.8 * np.nanmin(z_df)
 
     len_x_df_uniq = len(x_df)
     len_y_df_uniq = len(y_df)
 
-    z_temp_df = create_z_grid(len_x_df_uniq, len_y_df_uniq, z_df)
-
-    for idx, x_data in enumerate(x_df):
-        if color == 'x':
-            color_value = colors[idx % 9]
-
-        for idx2, y_data in enumerate(y_df):
-            if color == 'x+y':
-                color_value = colors[(idx + idx2 * len_y_df_uniq) % 9]
-
-            elif color == 'y':
-                color_value = colors[idx2 % 9]
-
-            x_max = x_min + step
-            y_max = y_min + step
-
-            z_max = z_temp_df[idx2 * len_x_df_uniq + idx]
-
-            if z_max is not None:
-                mesh_list.append(
-                    generate_mesh(
-                        x_min,
-                        x_max,
-                        y_min,
-                        y_max,
-                        z_min,
-                        z_max,
-                        color_value,
-                        flat_shading,
-                        hover_info,
-                    ),
-                )
-            else:
-                mesh_list.append(
-                    generate_mesh(
-                        x_min,
-                        x_max,
-                        y_min,
-                        y_max,
-                        z_min,
-                        z_max,
-                        color_value,
-                        flat_shading,
-                        hover_info,
-                        opacity=0.01,
-                    ),
-                )
-            x_min += 2 * step
-        y_min += 2 * step
-        x_min = 0
-    fig = go.Figure(mesh_list)
+    z_grid = create_z_grid(len_x_df_uniq, len_y_df_uniq, z_df)
+
+    vertices, faces = grid_geometry(z_grid, x_min, y_min, z_min, step)
+    x_index, y_index = np.divmod(np.arange(z_grid.size), len_y_df_uniq)
+    palette, color_index = bar_colors(color, x_index, y_index, len_y_df_uniq, palette)
+    z_index = y_index * len_x_df_uniq + x_index
+    bars = Bars(
+        vertices,
+        faces,
+        palette,
+        color_index,
+        np.where(np.isnan(z_grid.ravel(order='F')), 0.01, 1),
+        np.where(z_index < len(z_df), z_index, -1),
+    )
+
+    data = mesh_dicts(bars, flat_shading, hover_info, merge_traces, colorscale if color == 'z' else None)
 
     if x_legend == 'auto':
         x_legend = x_df
@@ -245,11 +628,10 @@ def bar_charts_from_sparse_array(
     if z_legend == 'auto':
         z_legend = None
 
-    fig = figure_layout(
-        fig,
+    fig_layout = layout_dict(
         x_legend,
         y_legend,
-        x_min,
+        0,
         len_x_df_uniq,
         x_title,
         y_title,
@@ -258,8 +640,146 @@ def bar_charts_from_sparse_array(
         z_title,
         title,
     )
+    fig = build_figure(data, fig_layout, output)
 
-    return fig
+    return (fig, bars) if return_bars else fig
+
+
+def sparse_triplets(z_df):
+    """
+    Get the (row, col, value) triplets of a scipy.sparse matrix or of a tuple of three arrays
+    """
+    if hasattr(z_df, 'tocoo'):
+        # tocsr sums duplicated entries of COO matrices
+        z_df = z_df.tocsr().tocoo()
+        return z_df.row, z_df.col, z_df.data
+    row, col, value = z_df
+    return np.asarray(row, dtype=int), np.asarray(col, dtype=int), np.asarray(value, dtype=float)
+
+
+def bar_charts_from_sparse_matrix(
+    x_df,
+    y_df,
+    z_df,
+    x_min=0,
+    y_min=0,
+    z_min='auto',
+    step=1,
+    color='x',
+    x_legend='auto',
+    y_legend='auto',
+    z_legend='auto',
+    flat_shading=True,
+    x_title='',
+    y_title='',
+    z_title='',
+    hover_info='z',
+    title='',
+    merge_traces=False,
+    return_bars=False,
+    output='figure',
+    palette='Plotly',
+    colorscale='Viridis',
+) -> go.Figure:
+    """
+    Convert a sparse matrix in 3D bar charts, only the stored values are drawn
+    Example :
+        xdf = [1, 10, 100]
+        ydf = [2, 4]
+        zdf = scipy.sparse.coo_matrix(([10, 45], ([0, 2], [0, 1])), shape=(3, 2))
+        fig = plotly_bar_charts_3d(xdf, ydf, zdf)
+        # or with (row, col, value) triplets
+        fig = bar_charts_from_sparse_matrix(xdf, ydf, ([0, 2], [0, 1], [10, 45]))
+        fig.show()
+    :param x_df: Serie or list of data corresponding to x-axis
+    :param y_df: Serie or list of data corresponding to y-axis
+    :param z_df: scipy.sparse matrix of shape (len(x_df), len(y_df)) or (row, col, value) triplets,
+                 the value at (row, col) is the height of the bar at x_df[row] and y_df[col], or a BarGrid
+                 whose values are all drawn at (x_codes, y_codes), x_df and y_df are then ignored
+    :param x_min: Starting position for x-axis
+    :param y_min: Starting position for y-axis
+    :param z_min: Minimum value of the barchart, if set to auto minimum value is 0.8 * minimum
+                  of the stored values to obtain more packed charts
+    :param step: Distance between two bar charts
+    :param color: Axis to create color, possible parameters are
+    x for a different color for each change of x
+    y for a different color for each change of y
+    or x+y to get a different color for each bar
+    or z to color every bar by its height along colorscale
+    :param x_legend: Legend of x-axis, if set to auto the legend is based on x_df
+    :param y_legend: Legend of y-axis, if set to auto the legend is based on y_df
+    :param z_legend: Legend of z axis, if set to auto the legend is not shown
+    :param flat_shading:
+    :param x_title: Title of x-axis
+    :param y_title: Title of y-axis
+    :param z_title: Title of z axis
+    :param hover_info: Hover info, z by default
+    :param title: Title of the graph, not functional for the moment
+    :param merge_traces: If True, draw all the bars sharing a color in a single Mesh3d instead of one
+                         Mesh3d per bar, much faster to build and render for big grids
+    :param return_bars: If True, return the Bars drawn along with the figure
+    :param output: 'figure' for a go.Figure or 'dict' for a plain dict built without plotly validation
+    :param palette: Colors of x, y and x+y, name of a plotly.colors.qualitative palette or list of colors
+    :param colorscale: Colors of z, name of a plotly colorscale or list of colors
+    :return: 3D mesh figure acting as 3D bar charts
+    """
+    if isinstance(z_df, tuple):
+        # Triplets are only accepted here, elsewhere a tuple is a sequence of z values
+        row, col, value = sparse_triplets(z_df)
+        grid = BarGrid(x_codes=row, y_codes=col, z=value, x_labels=np.asarray(x_df), y_labels=np.asarray(y_df))
+    else:
+        if hasattr(z_df, 'tocoo') and z_df.shape != (len(x_df), len(y_df)):
+            raise ValueError(f'Expected a sparse matrix of shape ({len(x_df)}, {len(y_df)}), received {z_df.shape}')
+        grid = BarGrid.from_data(x_df, y_df, z_df)
+    row, col, value = grid.x_codes, grid.y_codes, grid.z
+
+    if not len(value):
+        raise ValueError('The sparse matrix has no stored value to draw')
+    if row.min() < 0 or row.max() >= len(grid.x_labels) or col.min() < 0 or col.max() >= len(grid.y_labels):
+        raise ValueError(
+            f'Rows must be in [0, {len(grid.x_labels)}) and columns in [0, {len(grid.y_labels)}), '
+            'the number of x and y labels',
+        )
+
+    if z_min == 'auto':
+        z_min = 0.8 * np.nanmin(value)
+
+    len_x_df_uniq = len(grid.x_labels)
+    len_y_df_uniq = len(grid.y_labels)
+
+    x_start = x_min + 2 * step * row
+    y_start = y_min + 2 * step * col
+    vertices, faces = box_geometry(x_start, x_start + step, y_start, y_start + step, z_min, value)
+    palette, color_index = bar_colors(color, row, col, len_y_df_uniq, palette)
+    bars = Bars(vertices, faces, palette, color_index, np.ones(len(value)), np.arange(len(value)))
+
+    data = mesh_dicts(bars, flat_shading, hover_info, merge_traces, colorscale if color == 'z' else None)
+
+    if x_legend == 'auto':
+        x_legend = [str(x_ax) for x_ax in grid.x_labels]
+    if y_legend == 'auto':
+        y_legend = [str(y_ax) for y_ax in grid.y_labels]
+    if z_legend == 'auto':
+        z_legend = None
+
+    fig_layout = layout_dict(
+        x_legend,
+        y_legend,
+        0,
+        len_x_df_uniq,
+        x_title,
+        y_title,
+        len_y_df_uniq,
+        z_legend,
+        z_title,
+        title,
+    )
+    # Empty rows and columns are not drawn, the axes have to cover them explicitly
+    fig_layout['scene']['xaxis']['range'] = [x_min, x_min + 2 * step * len_x_df_uniq - step]
+    fig_layout['scene']['yaxis']['range'] = [y_min, y_min + 2 * step * len_y_df_uniq - step]
+    fig = build_figure(data, fig_layout, output)
+
+    return (fig, bars) if return_bars else fig
 
 
 def bar_charts_from_paired_data(
@@ -280,6 +800,12 @@ def bar_charts_from_paired_data(
     z_title='',
     hover_info='z',
     title='',
+    merge_traces=False,
+    return_bars=False,
+    layout: Layout | None = None,
+    output='figure',
+    palette='Plotly',
+    colorscale='Viridis',
 ) -> go.Figure:
     """
     Convert paired (x,y,z) data points into 3D bar charts
@@ -288,62 +814,30 @@ def bar_charts_from_paired_data(
         neighbours = [31, 24, 10, 28, 48]
         accuracies = [0.9727, 0.9994, 0.9994, 0.9995, 0.9995]
     Each index i represents a bar at position (x[i], y[i]) with height z[i]
+    :param return_bars: If True, return the Bars drawn along with the figure
+    :param output: 'figure' for a go.Figure or 'dict' for a plain dict built without plotly validation
+    :param palette: Colors of x, y and x+y, name of a plotly.colors.qualitative palette or list of colors
+    :param colorscale: Colors of z, name of a plotly colorscale or list of colors
+    :param layout: Result of detect_layout on the same data, computed if not given
     """
+    # Index of every value in the sorted unique values, used for positions, colors and axis labels
+    grid = BarGrid.from_data(x_df, y_df, z_df, layout)
+    x_idx, x_df_uniq = grid.x_codes, grid.x_labels
+    y_idx, y_df_uniq = grid.y_codes, grid.y_labels
+    z_df = grid.z
+
     if z_min == 'auto':
-        z_min = 0.8 * min(z_df)
-
-    mesh_list = []
-    colors = px.colors.qualitative.Plotly
-    color_value = 0
-
-    x_df = pd.Series(x_df)
-    y_df = pd.Series(y_df)
-    z_df = pd.Series(z_df)
-
-    # Get unique values for axis labels
-    x_df_uniq = sorted(x_df.unique())
-    y_df_uniq = sorted(y_df.unique())
-
-    # Create mapping from values to positions
-    x_positions = {val: idx * 2 for idx, val in enumerate(x_df_uniq)}
-    y_positions = {val: idx * 2 for idx, val in enumerate(y_df_uniq)}
-
-    # Plot each bar at its mapped position
-    for idx in range(len(x_df)):
-        x_val = x_df.iloc[idx]
-        y_val = y_df.iloc[idx]
-        z_val = z_df.iloc[idx]
-
-        # Get position indices
-        x_pos = x_positions[x_val]
-        y_pos = y_positions[y_val]
-
-        # Determine color based on color scheme
-        if color == 'x':
-            x_idx = x_df_uniq.index(x_val)
-            color_value = colors[x_idx % 9]
-        elif color == 'y':
-            y_idx = y_df_uniq.index(y_val)
-            color_value = colors[y_idx % 9]
-        elif color == 'x+y':
-            color_value = colors[idx % 9]
-
-        # Create bar
-        mesh_list.append(
-            generate_mesh(
-                x_pos,
-                x_pos + step,
-                y_pos,
-                y_pos + step,
-                z_min,
-                z_val,
-                color_value,
-                flat_shading,
-                hover_info,
-            ),
-        )
+        z_min = 0.8 * np.nanmin(z_df)
+
+    # Get position of each bar
+    x_pos = x_idx * 2
+    y_pos = y_idx * 2
+
+    vertices, faces = box_geometry(x_pos, x_pos + step, y_pos, y_pos + step, z_min, z_df)
+    palette, color_index = bar_colors(color, x_idx, y_idx, None, palette)
+    bars = Bars(vertices, faces, palette, color_index, np.ones(len(z_df)), np.arange(len(z_df)))
 
-    fig = go.Figure(mesh_list)
+    data = mesh_dicts(bars, flat_shading, hover_info, merge_traces, colorscale if color == 'z' else None)
 
     # Set up legends
     if x_legend == 'auto':
@@ -354,8 +848,7 @@ def bar_charts_from_paired_data(
         z_legend = None
 
     # Apply layout
-    fig = figure_layout(
-        fig,
+    fig_layout = layout_dict(
         x_legend,
         y_legend,
         0,
@@ -367,8 +860,9 @@ def bar_charts_from_paired_data(
         z_title,
         title,
     )
+    fig = build_figure(data, fig_layout, output)
 
-    return fig
+    return (fig, bars) if return_bars else fig
 
 
 def bar_charts3d_from_array(
@@ -389,6 +883,12 @@ def bar_charts3d_from_array(
     z_title='',
     hover_info='z',
     title='',
+    merge_traces=False,
+    return_bars=False,
+    layout: Layout | None = None,
+    output='figure',
+    palette='Plotly',
+    colorscale='Viridis',
 ) -> go.Figure:
     """
     Convert a dataframe in 3D bar charts similar to matplotlib ones
@@ -408,6 +908,7 @@ def bar_charts3d_from_array(
     x for a different color for each change of x
     y for a different color for each change of y
     or x+y to get a different color for each bar
+    or z to color every bar by its height along colorscale
     :param x_legend: Legend of x-axis, if set to auto the legend is based on x_df
     :param y_legend: Legend of y-axis, if set to auto the legend is based on y_df
     :param z_legend: Legend of z axis, if set to auto the legend is not shown
@@ -417,51 +918,41 @@ def bar_charts3d_from_array(
     :param z_title: Title of z axis
     :param hover_info: Hover info, z by default
     :param title: Title of the graph, not functional for the moment
+    :param merge_traces: If True, draw all the bars sharing a color in a single Mesh3d instead of one
+                         Mesh3d per bar, much faster to build and render for big grids
+    :param return_bars: If True, return the Bars drawn along with the figure
+    :param output: 'figure' for a go.Figure or 'dict' for a plain dict built without plotly validation
+    :param palette: Colors of x, y and x+y, name of a plotly.colors.qualitative palette or list of colors
+    :param colorscale: Colors of z, name of a plotly colorscale or list of colors
+    :param layout: Result of detect_layout on the same data, computed if not given
     :return: 3D mesh figure acting as 3D bar charts
     """
+    if layout is None:
+        layout = detect_layout(x_df, y_df, z_df)
 
-    if z_min == 'auto':
-        z_min = 0.8 * min(z_df)
-    mesh_list = []
-    colors = px.colors.qualitative.Plotly
-    color_value = 0
-
-    x_df = pd.Series(x_df)
-    y_df = pd.Series(y_df)
-    z_df = pd.Series(z_df)
-
-    x_df_uniq = x_df.unique()
-    y_df_uniq = y_df.unique()
+    x_df_uniq = layout.x_uniques
+    y_df_uniq = layout.y_uniques
     len_x_df_uniq = len(x_df_uniq)
     len_y_df_uniq = len(y_df_uniq)
 
-    for idx, x_data in enumerate(x_df_uniq):
-        if color == 'x':
-            color_value = colors[idx % 9]
-        for idx2, y_data in enumerate(y_df_uniq):
-            if color == 'x+y':
-                color_value = colors[(idx + idx2 * len(y_df.unique())) % 9]
-            elif color == 'y':
-                color_value = colors[idx2 % 9]
-            x_max = x_min + step
-            y_max = y_min + step
-            z_max = z_df[idx + idx2 * len_x_df_uniq]
-            mesh_list.append(
-                generate_mesh(
-                    x_min,
-                    x_max,
-                    y_min,
-                    y_max,
-                    z_min,
-                    z_max,
-                    color_value,
-                    flat_shading,
-                    hover_info,
-                ),
-            )
-            x_min += 2 * step
-        y_min += 2 * step
-        x_min = 0
+    with phase('grid'):
+        z_df = np.asarray(z_df, dtype=float)
+        z_grid = z_df.reshape(len_y_df_uniq, len_x_df_uniq)
+
+    if z_min == 'auto':
+        z_min = 0.8 * np.nanmin(z_df)
+
+    vertices, faces = grid_geometry(z_grid, x_min, y_min, z_min, step)
+    x_index, y_index = np.divmod(np.arange(z_grid.size), len_y_df_uniq)
+    palette, color_index = bar_colors(color, x_index, y_index, len_y_df_uniq, palette)
+    bars = Bars(
+        vertices,
+        faces,
+        palette,
+        color_index,
+        np.ones(z_grid.size),
+        y_index * len_x_df_uniq + x_index,
+    )
 
     if x_legend == 'auto':
         x_legend = x_df_uniq
@@ -472,13 +963,12 @@ def bar_charts3d_from_array(
     if z_legend == 'auto':
         z_legend = None
 
-    fig = go.Figure(mesh_list)
+    data = mesh_dicts(bars, flat_shading, hover_info, merge_traces, colorscale if color == 'z' else None)
 
-    fig = figure_layout(
-        fig,
+    fig_layout = layout_dict(
         x_legend,
         y_legend,
-        x_min,
+        0,
         len_x_df_uniq,
         x_title,
         y_title,
@@ -487,8 +977,114 @@ def bar_charts3d_from_array(
         z_title,
         title,
     )
+    fig = build_figure(data, fig_layout, output)
 
-    return fig
+    return (fig, bars) if return_bars else fig
+
+
+@phase('grid')
+def grid_labels(x_df, y_df, z_df):
+    """
+    Labels of the columns (x) and of the rows (y) of a 2D grid of z values, the columns and the index of a
+    DataFrame or 0 to n - 1 when they are not given
+    """
+    if x_df is None:
+        x_df = z_df.columns if hasattr(z_df, 'columns') else np.arange(z_df.shape[1])
+    if y_df is None:
+        y_df = z_df.index if hasattr(z_df, 'index') else np.arange(z_df.shape[0])
+    if z_df.shape != (len(y_df), len(x_df)):
+        raise ValueError(f'Expected a z grid of shape ({len(y_df)}, {len(x_df)}), received {z_df.shape}')
+    return np.asarray(x_df), np.asarray(y_df)
+
+
+def bar_charts_from_grid(
+    x_df,
+    y_df,
+    z_df,
+    x_min=0,
+    y_min=0,
+    z_min='auto',
+    step=1,
+    color='x',
+    x_legend='auto',
+    y_legend='auto',
+    z_legend='auto',
+    flat_shading=True,
+    x_title='',
+    y_title='',
+    z_title='',
+    hover_info='z',
+    title='',
+    merge_traces=False,
+    return_bars=False,
+    output='figure',
+    palette='Plotly',
+    colorscale='Viridis',
+) -> go.Figure:
+    """
+    Convert a 2D grid of z values in 3D bar charts, the memory of the grid is used as is
+    Example :
+        z_df = df.pivot(index='C', columns='Gamma', values='score 1')
+        fig = bar_charts_from_grid(None, None, z_df)
+    :param x_df: Labels of the columns, the columns of a DataFrame or 0 to n - 1 if None
+    :param y_df: Labels of the rows, the index of a DataFrame or 0 to n - 1 if None
+    :param z_df: 2D ndarray or DataFrame of shape (len(y_df), len(x_df)), z_df[i, j] is the height of the bar
+                 at y_df[i] and x_df[j], as a DataFrame pivoted with index=y and columns=x, NaN for no bar
+    Other parameters are the same as bar_charts3d_from_array
+    :return: 3D mesh figure acting as 3D bar charts
+    """
+    x_df, y_df = grid_labels(x_df, y_df, z_df)
+    z_grid = np.asarray(z_df, dtype=float)
+    len_y_df_uniq, len_x_df_uniq = z_grid.shape
+
+    if z_min == 'auto':
+        z_min = 0.8 * np.nanmin(z_grid)
+
+    # grid_geometry draws the first axis along x, bars come in the memory order of z_grid
+    vertices, faces = grid_geometry(z_grid.T, x_min, y_min, z_min, step)
+    bar_index = np.arange(z_grid.size)
+    y_index, x_index = np.divmod(bar_index, len_x_df_uniq)
+    palette, color_index = bar_colors(color, x_index, y_index, len_x_df_uniq, palette)
+    bars = Bars(
+        vertices,
+        faces,
+        palette,
+        color_index,
+        np.where(np.isnan(z_grid.ravel()), 0.01, 1),
+        bar_index,
+    )
+
+    data = mesh_dicts(bars, flat_shading, hover_info, merge_traces, colorscale if color == 'z' else None)
+
+    if x_legend == 'auto':
+        x_legend = [str(x_ax) for x_ax in x_df]
+    if y_legend == 'auto':
+        y_legend = [str(y_ax) for y_ax in y_df]
+    if z_legend == 'auto':
+        z_legend = None
+
+    fig_layout = layout_dict(
+        x_legend,
+        y_legend,
+        0,
+        len_x_df_uniq,
+        x_title,
+        y_title,
+        len_y_df_uniq,
+        z_legend,
+        z_title,
+        title,
+    )
+    fig = build_figure(data, fig_layout, output)
+
+    return (fig, bars) if return_bars else fig
+
+
+def is_grid(z_df) -> bool:
+    """
+    Whether z_df is a 2D ndarray or DataFrame of z values, see bar_charts_from_grid
+    """
+    return getattr(z_df, 'ndim', 1) == 2 and not hasattr(z_df, 'tocoo')
 
 
 def verify_input(x, y, z) -> bool:
@@ -507,6 +1103,97 @@ def verify_input(x, y, z) -> bool:
     )
 
 
+class Layout(NamedTuple):
+    """
+    Layout of the input data found by detect_layout
+    mode: 'grid' for a full grid, 'paired' for (x[i], y[i], z[i]) points or 'sparse' for a flattened array
+    x_codes: index in x_uniques of every x value
+    x_uniques: unique x values in order of appearance
+    y_codes: index in y_uniques of every y value
+    y_uniques: unique y values in order of appearance
+    """
+    mode: str
+    x_codes: np.ndarray
+    x_uniques: np.ndarray
+    y_codes: np.ndarray
+    y_uniques: np.ndarray
+
+
+def is_pandas(values) -> bool:
+    """
+    Check if values are a pandas object without importing pandas
+    """
+    return type(values).__module__.partition('.')[0] == 'pandas'
+
+
+def factorize(values):
+    """
+    Encode values as integer codes
+    pandas hashing is used for pandas objects and a dict for lists, in O(n), numpy arrays are encoded with
+    np.unique in O(n log n), so pandas is not imported
+    :return: index in uniques of every value and unique values in order of appearance
+    """
+    if is_pandas(values):
+        import pandas as pd
+
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        return codes, np.asarray(uniques)
+
+    if not isinstance(values, np.ndarray) or values.dtype.hasobject:
+        index: dict = {}
+        codes = np.fromiter((index.setdefault(value, len(index)) for value in values), dtype=np.intp)
+        if len({type(value) for value in index}) <= 1:
+            return codes, np.asarray(list(index))
+        # np.asarray would convert 1 and '1' to the same string
+        uniques = np.empty(len(index), dtype=object)
+        uniques[:] = list(index)
+        return codes, uniques
+
+    uniques, first_index, codes = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first_index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[codes.ravel()], uniques[order]
+
+
+@phase('detection')
+def detect_layout(x, y, z) -> Layout:
+    """
+    Find how the data is arranged, in O(n) time and memory for pandas objects and lists, O(n log n) time for
+    numpy arrays, see factorize
+    A full grid has one z value for each combination of the unique x and y values, since it has exactly
+    len(x_uniques) * len(y_uniques) points it is enough to check that no (x, y) pair is repeated
+    """
+    verify_input(x, y, z)
+
+    x_codes, x_uniques = factorize(x)
+    y_codes, y_uniques = factorize(y)
+
+    if len(x) == len(y) == len(z):
+        n_cells = len(x_uniques) * len(y_uniques)
+        mode = 'paired'
+        if len(z) == n_cells:
+            cells = x_codes.astype(np.int64) * len(y_uniques) + y_codes
+            if np.bincount(cells, minlength=n_cells).max(initial=0) <= 1:
+                mode = 'grid'
+    else:
+        mode = 'sparse'
+
+    return Layout(mode, x_codes, x_uniques, y_codes, y_uniques)
+
+
+@phase('grid')
+def sort_codes(codes, uniques):
+    """
+    Encode codes of factorize as indexes in the sorted unique values
+    :return: new codes and sorted unique values
+    """
+    order = np.argsort(uniques, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[codes], uniques[order]
+
+
 def convert_to_str(x: list[str]):
     """ "
     Convert a list to a string
@@ -514,6 +1201,196 @@ def convert_to_str(x: list[str]):
     return [str(x) for x in x]
 
 
+class BarGrid:
+    """
+    Values of a chart placed in the cells of a grid, the common form of the data of every input layout
+    Only arrays are kept, about 25 bytes per value
+    x_codes: index in x_labels of every value
+    y_codes: index in y_labels of every value
+    z: every value, float32 values are kept as float32
+    x_labels: labels of the x-axis, in the order of the chart
+    y_labels: labels of the y-axis, in the order of the chart
+    """
+
+    __slots__ = ('x_codes', 'y_codes', 'z', 'x_labels', 'y_labels')
+
+    def __init__(self, x_codes, y_codes, z, x_labels, y_labels):
+        self.x_codes = np.asarray(x_codes)
+        self.y_codes = np.asarray(y_codes)
+        z = np.asarray(z)
+        self.z = z if z.dtype.kind == 'f' else z.astype(float)
+        self.x_labels = x_labels
+        self.y_labels = y_labels
+
+    def __len__(self):
+        return len(self.z)
+
+    def __repr__(self):
+        return f'BarGrid({len(self)} values, {len(self.x_labels)} x labels, {len(self.y_labels)} y labels)'
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the codes and values
+        """
+        return self.x_codes.nbytes + self.y_codes.nbytes + self.z.nbytes
+
+    @classmethod
+    def from_data(cls, x_df, y_df, z_df, layout: Layout | None = None) -> BarGrid:
+        """
+        Find the cell of every z value, whatever the layout of the data
+        Codes of a full grid follow the order of appearance of the values, codes of paired data and of a
+        flattened array the sorted values, codes of a sparse matrix are its rows and columns
+        :param x_df: Serie or list of data corresponding to x-axis, None for the columns of a 2D grid
+        :param y_df: Serie or list of data corresponding to y-axis, None for the index of a 2D grid
+        :param z_df: z values in any layout accepted by plotly_bar_charts_3d, a BarGrid is returned as is
+        :param layout: Result of detect_layout on the same data, computed if needed and not given
+        """
+        if isinstance(z_df, BarGrid):
+            return z_df
+        if hasattr(z_df, 'tocoo'):
+            row, col, value = sparse_triplets(z_df)
+            return cls(row, col, value, np.asarray(x_df), np.asarray(y_df))
+        if is_grid(z_df):
+            x_labels, y_labels = grid_labels(x_df, y_df, z_df)
+            # Rows of the grid are y values, its memory is read as is
+            y_codes, x_codes = np.divmod(np.arange(z_df.size), len(x_labels))
+            return cls(x_codes, y_codes, np.asarray(z_df).ravel(), x_labels, y_labels)
+
+        if layout is None:
+            layout = detect_layout(x_df, y_df, z_df)
+        values = np.asarray(z_df)
+        z_df = values if values.dtype.kind == 'f' else np.asarray(z_df, dtype=float)
+
+        if layout.mode == 'sparse':
+            # Flattened array, x varies first
+            cells = np.arange(min(len(z_df), len(x_df) * len(y_df)))
+            return cls(cells % len(x_df), cells // len(x_df), z_df[:len(cells)], np.asarray(x_df), np.asarray(y_df))
+        if layout.mode == 'paired':
+            x_codes, x_labels = sort_codes(layout.x_codes, layout.x_uniques)
+            y_codes, y_labels = sort_codes(layout.y_codes, layout.y_uniques)
+            return cls(x_codes, y_codes, z_df, x_labels, y_labels)
+        return cls(layout.x_codes, layout.y_codes, z_df, layout.x_uniques, layout.y_uniques)
+
+
+def block_size(len_x, len_y, max_bars):
+    """
+    Smallest side of the square blocks of cells so that there are at most max_bars blocks
+    """
+    block = max(1, int(np.sqrt(len_x * len_y / max_bars)))
+    while -(-len_x // block) * -(-len_y // block) > max_bars:
+        block += 1
+    return block
+
+
+def block_labels(labels, block):
+    """
+    Label of every block of consecutive labels, 'first - last' or the label itself for a block of one
+    """
+    legend = []
+    for start in range(0, len(labels), block):
+        end = min(start + block, len(labels)) - 1
+        legend.append(str(labels[start]) if start == end else f'{labels[start]} - {labels[end]}')
+    return legend
+
+
+def aggregate(cells, values, n_cells, reducer='mean'):
+    """
+    Reduce the values falling in the same cell, NaN values are ignored
+    :param cells: cell of every value
+    :param values: values to reduce
+    :param n_cells: number of cells
+    :param reducer: mean, max or sum
+    :return: value of every cell, NaN for a cell without value
+    """
+    valid = ~np.isnan(values)
+    cells, values = cells[valid], values[valid]
+    count = np.bincount(cells, minlength=n_cells)
+
+    if reducer == 'max':
+        result = np.full(n_cells, -np.inf)
+        np.maximum.at(result, cells, values)
+    elif reducer in ('mean', 'sum'):
+        result = np.bincount(cells, weights=values, minlength=n_cells)
+        if reducer == 'mean':
+            result /= np.maximum(count, 1)
+    else:
+        raise ValueError(f'Unknown reducer {reducer}, expected mean, max or sum')
+
+    result[count == 0] = np.nan
+    return result
+
+
+@phase('level_of_detail')
+def level_of_detail(x_df, y_df, z_df, max_bars, reducer='mean'):
+    """
+    Bin the x and y categories in blocks so that at most max_bars bars are drawn
+    Blocks are squares of consecutive categories along the axes, values of a block are reduced to one bar
+    :param x_df: Serie or list of data corresponding to x-axis
+    :param y_df: Serie or list of data corresponding to y-axis
+    :param z_df: Serie or list of data corresponding to height of the bar chart, in any layout accepted by
+                 plotly_bar_charts_3d
+    :param max_bars: Maximum number of bars
+    :param reducer: mean, max or sum of the values of a block
+    :return: x and y labels of the blocks and (row, col, value) triplets for bar_charts_from_sparse_matrix
+    """
+    if is_grid(z_df):
+        return grid_level_of_detail(x_df, y_df, z_df, max_bars, reducer)
+
+    grid = BarGrid.from_data(x_df, y_df, z_df)
+
+    block = block_size(len(grid.x_labels), len(grid.y_labels), max_bars)
+    len_x_blocks = -(-len(grid.x_labels) // block)
+    len_y_blocks = -(-len(grid.y_labels) // block)
+
+    cells = (grid.x_codes // block) * len_y_blocks + grid.y_codes // block
+    values = aggregate(cells, grid.z, len_x_blocks * len_y_blocks, reducer)
+    filled = np.flatnonzero(~np.isnan(values))
+    row, col = np.divmod(filled, len_y_blocks)
+
+    return block_labels(grid.x_labels, block), block_labels(grid.y_labels, block), (row, col, values[filled])
+
+
+@phase('level_of_detail')
+def grid_level_of_detail(x_df, y_df, z_df, max_bars, reducer='mean', tile_bytes=16 * 2 ** 20):
+    """
+    level_of_detail of a 2D grid read by tiles of rows, for grids too big to be loaded in memory such as a
+    np.memmap of a .npy file
+    Tiles hold whole rows of blocks, so every block is reduced from a single tile and only one tile is in
+    memory at a time
+    :param x_df: Labels of the columns, see bar_charts_from_grid
+    :param y_df: Labels of the rows, see bar_charts_from_grid
+    :param z_df: 2D ndarray, np.memmap or DataFrame of shape (len(y_df), len(x_df))
+    :param max_bars: Maximum number of bars
+    :param reducer: mean, max or sum of the values of a block
+    :param tile_bytes: Size of a tile of float64 values, the peak memory is a few tiles
+    :return: same as level_of_detail
+    """
+    x_labels, y_labels = grid_labels(x_df, y_df, z_df)
+    if hasattr(z_df, 'columns'):
+        z_df = z_df.to_numpy()
+
+    block = block_size(len(x_labels), len(y_labels), max_bars)
+    len_x_blocks = -(-len(x_labels) // block)
+    len_y_blocks = -(-len(y_labels) // block)
+    tile_rows = block * max(1, tile_bytes // (8 * block * len(x_labels)))
+    x_blocks = np.arange(len(x_labels)) // block
+
+    tiles = []
+    for start in range(0, len(y_labels), tile_rows):
+        tile = np.asarray(z_df[start:start + tile_rows], dtype=float)
+        y_blocks = np.arange(len(tile)) // block
+        cells = x_blocks * (y_blocks[-1] + 1) + y_blocks[:, np.newaxis]
+        values = aggregate(cells.ravel(), tile.ravel(), len_x_blocks * (y_blocks[-1] + 1), reducer)
+        tiles.append(values.reshape(len_x_blocks, -1))
+    values = np.concatenate(tiles, axis=1).ravel()
+
+    filled = np.flatnonzero(~np.isnan(values))
+    row, col = np.divmod(filled, len_y_blocks)
+
+    return block_labels(x_labels, block), block_labels(y_labels, block), (row, col, values[filled])
+
+
 def plotly_bar_charts_3d(
     x_df,
     y_df,
@@ -532,6 +1409,13 @@ def plotly_bar_charts_3d(
     z_title='',
     hover_info='z',
     title='',
+    merge_traces=False,
+    return_bars=False,
+    max_bars=None,
+    lod_reducer='mean',
+    output='figure',
+    palette='Plotly',
+    colorscale='Viridis',
 ):
     """
     Generate a barchart in 3D or a sparse barchart in 3D
@@ -548,95 +1432,651 @@ def plotly_bar_charts_3d(
             features, neighbours, accuracies,
             x_title='Features', y_title='Neighbours', z_title='Accuracy',
         ).show()
+    z_df can also be a scipy.sparse matrix of shape (len(x_df), len(y_df)), see bar_charts_from_sparse_matrix,
+    or a 2D ndarray or DataFrame pivoted with index=y and columns=x, x_df and y_df can then be None to use the
+    columns and the index, see bar_charts_from_grid
+    z_df can also be a BarGrid, drawn like a sparse matrix, see BarGrid.from_data
+    z_df can be the path of a .npy file of such a 2D array, it is memory-mapped and with max_bars it is read by
+    tiles without being loaded as a whole, see grid_level_of_detail
+    With max_bars, consecutive x and y categories are binned in blocks whose values are reduced with
+    lod_reducer (mean, max or sum) so that at most max_bars bars are drawn, see level_of_detail
+    With output='dict', the figure is returned as a plain {'data': ..., 'layout': ...} dict and plotly
+    validators are skipped, go.Figure(result) validates it once when needed
+    color='z' colors the bars by their height along colorscale through the Mesh3d intensity, computed by
+    plotly.js, with merge_traces=True all the bars are then drawn in a single Mesh3d
+    Categories of x, y and x+y cycle through the colors of palette
     """
-    verify_input(x_df, y_df, z_df)
-
-    x_series = pd.Series(x_df)
-    y_series = pd.Series(y_df)
-
-    # Check if we have a full grid (all combinations of unique x and y values)
-    unique_x = x_series.nunique()
-    unique_y = y_series.nunique()
-
-    # Case 1: Full grid data - we have z values for every combination of unique x and y
-    if len(z_df) == unique_x * unique_y and len(x_series) == len(y_series) == len(z_df):
-        # Check if this is actually a full grid by seeing if we have all combinations
-        # This handles the CSV case where we have repeated x,y values in order
-        x_vals = x_series.unique()
-        y_vals = y_series.unique()
-        expected_pairs = {(x, y) for x in x_vals for y in y_vals}
-        actual_pairs = set(zip(x_series, y_series))
-
-        if expected_pairs == actual_pairs:
-            # Full grid data - use array version
-            return bar_charts3d_from_array(
-                x_df,
-                y_df,
-                z_df,
-                x_min=x_min,
-                y_min=y_min,
-                z_min=z_min,
-                step=step,
-                color=color,
-                x_legend=x_legend,
-                y_legend=y_legend,
-                z_legend=z_legend,
-                flat_shading=flat_shading,
-                x_title=x_title,
-                y_title=y_title,
-                z_title=z_title,
-                hover_info=hover_info,
-                title=title,
-            )
+    if isinstance(z_df, (str, os.PathLike)):
+        # .npy file, mapped in memory instead of being loaded
+        z_df = np.load(z_df, mmap_mode='r')
+
+    if max_bars is not None:
+        if max_bars < 1:
+            raise ValueError(f'max_bars must be at least 1, received {max_bars}')
+        x_df, y_df, z_df = level_of_detail(x_df, y_df, z_df, max_bars, lod_reducer)
+        builder = bar_charts_from_sparse_matrix
+    elif hasattr(z_df, 'tocoo') or isinstance(z_df, BarGrid):
+        # scipy.sparse matrix or BarGrid - only the stored values are drawn
+        builder = bar_charts_from_sparse_matrix
+    elif is_grid(z_df):
+        # 2D ndarray or pivoted DataFrame - x_df and y_df label the columns and the rows
+        builder = bar_charts_from_grid
+    else:
+        layout = detect_layout(x_df, y_df, z_df)
+
+        if layout.mode == 'grid':
+            # Full grid data - z values for every combination of unique x and y
+            builder = partial(bar_charts3d_from_array, layout=layout)
+        elif layout.mode == 'paired':
+            # Paired data - each (x[i], y[i], z[i]) represents one bar
+            builder = partial(bar_charts_from_paired_data, layout=layout)
+        else:
+            # Sparse array data
+            builder = bar_charts_from_sparse_array
+
+    return builder(
+        x_df,
+        y_df,
+        z_df,
+        x_min=x_min,
+        y_min=y_min,
+        z_min=z_min,
+        step=step,
+        color=color,
+        x_legend=x_legend,
+        y_legend=y_legend,
+        z_legend=z_legend,
+        flat_shading=flat_shading,
+        x_title=x_title,
+        y_title=y_title,
+        z_title=z_title,
+        hover_info=hover_info,
+        title=title,
+        merge_traces=merge_traces,
+        return_bars=return_bars,
+        output=output,
+        palette=palette,
+        colorscale=colorscale,
+    )
 
-    # Case 2: Paired data - each (x[i], y[i], z[i]) represents one bar
-    elif len(x_series) == len(y_series) == len(z_df):
-        # Use paired data version
-        return bar_charts_from_paired_data(
-            x_df,
-            y_df,
-            z_df,
-            x_min=x_min,
-            y_min=y_min,
-            z_min=z_min,
-            step=step,
-            color=color,
-            x_legend=x_legend,
-            y_legend=y_legend,
-            z_legend=z_legend,
-            flat_shading=flat_shading,
-            x_title=x_title,
-            y_title=y_title,
-            z_title=z_title,
-            hover_info=hover_info,
-            title=title,
-        )
 
-    # Case 3: Sparse array data
+CSV_AGGREGATIONS = {
+    'mean': ('sum', 'count'),
+    'sum': ('sum',),
+    'count': ('count',),
+    'max': ('max',),
+    'min': ('min',),
+}
+
+
+def aggregate_csv(path, x_col, y_col, z_col, agg='mean', chunksize=1_000_000, **read_csv_kwargs):
+    """
+    Aggregate the z values of every (x, y) cell of a CSV file read by chunks
+    Only the partial aggregates of the cells are kept between chunks, memory is bounded by the chunk size
+    and the number of cells, not by the size of the file
+    :param path: Path or buffer of the CSV file
+    :param x_col: Column corresponding to x-axis
+    :param y_col: Column corresponding to y-axis
+    :param z_col: Column corresponding to height of the bar chart
+    :param agg: mean, sum, count, max or min of the z values of a cell
+    :param chunksize: Number of rows read at once
+    :param read_csv_kwargs: Other arguments of pd.read_csv
+    :return: x, y and aggregated z Series, one row per cell in order of first appearance
+    """
+    import pandas as pd
+
+    if agg not in CSV_AGGREGATIONS:
+        raise ValueError(f'Unknown aggregation {agg}, expected one of {", ".join(CSV_AGGREGATIONS)}')
+    statistics = CSV_AGGREGATIONS[agg]
+    # Partial aggregates are combined with sum for sum and count, max for max and min for min
+    combine = {statistic: 'sum' if statistic == 'count' else statistic for statistic in statistics}
+
+    cells = None
+    for chunk in pd.read_csv(
+        path,
+        usecols=[x_col, y_col, z_col],
+        chunksize=chunksize,
+        **read_csv_kwargs,
+    ):
+        chunk_cells = chunk.groupby([x_col, y_col], sort=False)[z_col].agg(list(statistics))
+        if cells is None:
+            cells = chunk_cells
+        else:
+            cells = pd.concat([cells, chunk_cells]).groupby(level=[0, 1], sort=False).agg(combine)
+
+    if cells is None:
+        raise ValueError(f'No data in {path}')
+
+    z_df = cells['sum'] / cells['count'] if agg == 'mean' else cells[agg]
+    return (
+        pd.Series(cells.index.get_level_values(0), name=x_col),
+        pd.Series(cells.index.get_level_values(1), name=y_col),
+        pd.Series(z_df.to_numpy(), name=z_col),
+    )
+
+
+def bar_chart_from_csv(
+    path,
+    x_col,
+    y_col,
+    z_col,
+    agg='mean',
+    chunksize=1_000_000,
+    read_csv_kwargs=None,
+    **kwargs,
+):
+    """
+    Create a 3D bar chart from a CSV file of any size, z values are aggregated per (x, y) cell while the
+    file is read by chunks
+    Example :
+        fig = bar_chart_from_csv('examples/dataExample.csv', 'Gamma', 'C', 'score 1', x_title='Gamma')
+        fig.show()
+    :param path: Path or buffer of the CSV file
+    :param x_col: Column corresponding to x-axis
+    :param y_col: Column corresponding to y-axis
+    :param z_col: Column corresponding to height of the bar chart
+    :param agg: mean, sum, count, max or min of the z values of a cell
+    :param chunksize: Number of rows read at once
+    :param read_csv_kwargs: dict of other arguments of pd.read_csv
+    :param kwargs: Options of plotly_bar_charts_3d
+    :return: 3D mesh figure acting as 3D bar charts
+    """
+    x_df, y_df, z_df = aggregate_csv(path, x_col, y_col, z_col, agg, chunksize, **(read_csv_kwargs or {}))
+    return plotly_bar_charts_3d(x_df, y_df, z_df, **kwargs)
+
+
+def z_values(z_df):
+    """
+    Values of z_df as a flat float array, the stored values of a sparse matrix or of a BarGrid
+    """
+    if hasattr(z_df, 'tocoo'):
+        z_df = sparse_triplets(z_df)[2]
+    elif isinstance(z_df, BarGrid):
+        z_df = z_df.z
+    return np.asarray(z_df, dtype=float).ravel()
+
+
+class BarChart3D:
+    """
+    3D bar chart whose heights can be changed without rebuilding it
+    Positions, colors, traces and layout are computed once, update_z only rewrites the z coordinates of the
+    top four vertices of the bars in the traces where a height changed
+    Example :
+        chart = BarChart3D(xdf, ydf, zdf, merge_traces=True, figure_class=go.FigureWidget)
+        display(chart.figure)
+        chart.update_z(new_zdf)
+    """
+
+    def __init__(self, x_df, y_df, z_df, figure_class=go.Figure, **kwargs):
+        """
+        :param x_df: Serie or list of data corresponding to x-axis
+        :param y_df: Serie or list of data corresponding to y-axis
+        :param z_df: Serie or list of data corresponding to height of the bar chart
+        :param figure_class: go.Figure, or go.FigureWidget to update a displayed widget
+        :param kwargs: Options of plotly_bar_charts_3d, except max_bars
+        """
+        if kwargs.get('max_bars') is not None:
+            # Bars would be blocks of values, new z values are not reduced to them
+            raise ValueError('max_bars is not supported, reduce the values with level_of_detail first')
+        fig, self.bars = plotly_bar_charts_3d(x_df, y_df, z_df, return_bars=True, **kwargs)
+        self.figure = figure_class(fig)
+
+        self.sparse_matrix = hasattr(z_df, 'tocoo') or isinstance(z_df, BarGrid)
+        self.z_size = len(self.bars.z_index) if self.sparse_matrix else np.size(z_df)
+        self.traces = group_bars(self.bars.color_index, self.bars.opacity, kwargs.get('merge_traces', False))
+        self.color_by_height = kwargs.get('color') == 'z'
+        self.trace_of_bar = np.empty(len(self.bars.z_index), dtype=int)
+        for trace_index, bars in enumerate(self.traces):
+            self.trace_of_bar[bars] = trace_index
+        self.trace_z = [np.array(trace.z, dtype=float) for trace in self.figure.data]
+        self.heights = self.bars.vertices[4::8, 2].copy()
+
+    def bar_heights(self, z_df):
+        """
+        Height of every bar, in drawing order, for new z values given as for the creation of the chart
+        (stored values or a matrix with the same sparsity for a sparse matrix, a BarGrid with the same cells)
+        """
+        z_df = z_values(z_df)
+        if z_df.size != self.z_size:
+            raise ValueError(f'Expected {self.z_size} z values, received {z_df.size}')
+
+        z_index = self.bars.z_index
+        return np.where(z_index >= 0, z_df[z_index], np.nan)
+
+    def traces_z(self, z_df):
+        """
+        z coordinates of the vertices of every trace for new z values, the chart is not changed
+        """
+        heights = self.bar_heights(z_df)
+        traces_z = []
+        for trace_z, bars in zip(self.trace_z, self.traces):
+            trace_z = trace_z.copy()
+            trace_z.reshape(-1, 8)[:, 4:] = heights[bars, np.newaxis]
+            traces_z.append(trace_z)
+        return traces_z
+
+    def update_z(self, z_df):
+        """
+        Change the height of the bars, colors and opacities of the bars are kept, with color='z' the intensity
+        follows the new heights along the colorscale range of the creation of the chart
+        Only the traces with a changed height are updated, through plotly_restyle so a FigureWidget only
+        sends them to the browser
+        :param z_df: New z values, same shape as the z values of the creation of the chart
+        :return: restyle data and trace indexes, arguments of Plotly.restyle to update a figure in a browser
+        """
+        heights = self.bar_heights(z_df)
+        changed = (heights != self.heights) & ~(np.isnan(heights) & np.isnan(self.heights))
+
+        trace_indexes = np.unique(self.trace_of_bar[changed]).tolist()
+        for trace_index in trace_indexes:
+            bars = self.traces[trace_index]
+            self.trace_z[trace_index].reshape(-1, 8)[:, 4:] = heights[bars, np.newaxis]
+        self.heights = heights
+
+        restyle_data = {'z': [self.trace_z[trace_index] for trace_index in trace_indexes]}
+        if self.color_by_height:
+            restyle_data['intensity'] = [height_intensity(trace_z) for trace_z in restyle_data['z']]
+        if trace_indexes:
+            self.figure.plotly_restyle(restyle_data, trace_indexes=trace_indexes)
+        return restyle_data, trace_indexes
+
+
+def plotly_bar_charts_3d_animation(x_df, y_df, z_frames, frame_names=None, frame_duration=200, **kwargs):
+    """
+    Animated 3D bar chart of z values changing over time
+    Positions, triangles, colors and layout are computed once from the first frame, every go.Frame only holds
+    the z coordinates of the traces, and their intensity with color='z'
+    Example :
+        z_frames = [metric[metric['time'] == time]['value'] for time in times]
+        fig = plotly_bar_charts_3d_animation(xdf, ydf, z_frames, frame_names=[str(time) for time in times])
+        fig.show()
+    :param x_df: Serie or list of data corresponding to x-axis
+    :param y_df: Serie or list of data corresponding to y-axis
+    :param z_frames: Sequence of z values, one per frame, each given as z_df of plotly_bar_charts_3d with the
+                     same shape (and the same sparsity for sparse matrices)
+    :param frame_names: Names of the frames shown by the slider, 0 to n - 1 if None
+    :param frame_duration: Duration of a frame in milliseconds when playing
+    :param kwargs: Options of plotly_bar_charts_3d except max_bars, merge_traces is True by default and z_min
+                   is computed from every frame if auto
+    :return: figure with the frames, a play and a pause button and a slider
+    """
+    z_frames = list(z_frames)
+    if frame_names is None:
+        frame_names = [str(index) for index in range(len(z_frames))]
+    if len(frame_names) != len(z_frames):
+        raise ValueError(f'Expected {len(z_frames)} frame names, received {len(frame_names)}')
+
+    values = [z_values(z_df) for z_df in z_frames]
+    if kwargs.get('z_min', 'auto') == 'auto':
+        kwargs['z_min'] = 0.8 * min(np.nanmin(frame_values) for frame_values in values)
+    kwargs.setdefault('merge_traces', True)
+
+    chart = BarChart3D(x_df, y_df, z_frames[0], **kwargs)
+    trace_indexes = list(range(len(chart.traces)))
+    frames = []
+    for z_df, name in zip(z_frames, frame_names):
+        # float32 halves the size of the frames, heights do not need more precision to be drawn
+        data = [dict(type='mesh3d', z=trace_z.astype(np.float32)) for trace_z in chart.traces_z(z_df)]
+        if chart.color_by_height:
+            for trace in data:
+                trace['intensity'] = height_intensity(trace['z'])
+        frames.append(go.Frame(data=data, traces=trace_indexes, name=name))
+
+    fig = chart.figure
+    fig.frames = frames
+    z_max = max(np.nanmax(frame_values) for frame_values in values)
+    if chart.color_by_height:
+        # Every frame is colored on the range of the heights of all the frames
+        fig.update_traces(cmin=min(np.nanmin(frame_values) for frame_values in values), cmax=z_max)
+    play = dict(frame=dict(duration=frame_duration, redraw=True), fromcurrent=True, transition=dict(duration=0))
+    pause = dict(frame=dict(duration=0, redraw=False), mode='immediate', transition=dict(duration=0))
+    show = dict(frame=dict(duration=0, redraw=True), mode='immediate', transition=dict(duration=0))
+    fig.update_layout(
+        # The z-axis does not follow the heights of the shown frame
+        scene=dict(zaxis=dict(range=[kwargs['z_min'], z_max])),
+        updatemenus=[
+            dict(
+                type='buttons',
+                showactive=False,
+                buttons=[
+                    dict(label='Play', method='animate', args=[None, play]),
+                    dict(label='Pause', method='animate', args=[[None], pause]),
+                ],
+            ),
+        ],
+        sliders=[
+            dict(
+                steps=[dict(label=name, method='animate', args=[[name], show]) for name in frame_names],
+            ),
+        ],
+    )
+    return fig
+
+
+def decode_typed_array(values):
+    """
+    Convert a plotly.js typed array {'dtype': 'f8', 'bdata': base64 string} or a sequence to a numpy array
+    """
+    if isinstance(values, dict) and 'bdata' in values:
+        return np.frombuffer(base64.b64decode(values['bdata']), dtype=np.dtype('<' + values['dtype']))
+    return np.asarray(values)
+
+
+def encode_typed_array(values, dtype):
+    """
+    Convert values to a plotly.js typed array {'dtype': 'f4', 'bdata': base64 string}
+    """
+    array = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': array.dtype.str[1:], 'bdata': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+@phase('serialization')
+def to_compact_json(fig: go.Figure | dict) -> str:
+    """
+    Serialize a figure like fig.to_json() but with the coordinates of the Mesh3d traces as float32 and
+    their triangle indices as the smallest unsigned integer type able to hold them, both base64 encoded
+    Typed arrays need plotly.js >= 2.28 (plotly >= 5.19) on the page displaying the figure
+    :param fig: go.Figure or dict figure (output='dict'), which is not modified
+    """
+    if isinstance(fig, dict):
+        fig_dict = {**fig, 'data': [dict(trace) for trace in fig['data']]}
     else:
-        # Sparse data - use sparse array version
-        return bar_charts_from_sparse_array(
-            x_df,
-            y_df,
-            z_df,
-            x_min=x_min,
-            y_min=y_min,
-            z_min=z_min,
-            step=step,
-            color=color,
-            x_legend=x_legend,
-            y_legend=y_legend,
-            z_legend=z_legend,
-            flat_shading=flat_shading,
-            x_title=x_title,
-            y_title=y_title,
-            z_title=z_title,
-            hover_info=hover_info,
-            title=title,
+        fig_dict = fig.to_plotly_json()
+    for trace in fig_dict['data']:
+        if trace.get('type') != 'mesh3d':
+            continue
+        for key in ('x', 'y', 'z', 'intensity'):
+            if trace.get(key) is not None:
+                trace[key] = encode_typed_array(decode_typed_array(trace[key]), np.float32)
+        for key in ('i', 'j', 'k'):
+            if trace.get(key) is not None:
+                indices = decode_typed_array(trace[key])
+                dtype = np.min_scalar_type(indices.max(initial=0))
+                trace[key] = encode_typed_array(indices, dtype)
+    return pio.to_json(fig_dict, validate=False)
+
+
+def compact_json_saving(fig: go.Figure) -> dict:
+    """
+    Compare the size of fig.to_json() and to_compact_json(fig)
+    :return: dict with the size of both in bytes and their ratio
+    """
+    json_size = len(fig.to_json())
+    compact_size = len(to_compact_json(fig))
+    return {
+        'json_bytes': json_size,
+        'compact_bytes': compact_size,
+        'ratio': json_size / compact_size,
+    }
+
+
+def content_hash(*values, **options) -> str:
+    """
+    Fast hash of the content of arrays, lists, Series, DataFrames with their labels, BarGrid or scipy.sparse
+    matrices and of keyword options, files are hashed by path, size and modification time
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        if isinstance(value, BarGrid):
+            value = content_hash(value.x_codes, value.y_codes, value.z, value.x_labels, value.y_labels)
+        if isinstance(value, os.PathLike) or isinstance(value, str) and os.path.isfile(value):
+            # .npy file, a rewritten file is another chart
+            stat = os.stat(value)
+            value = f'{os.fspath(value)}:{stat.st_size}:{stat.st_mtime_ns}'
+        if hasattr(value, 'columns'):
+            # Index and columns of a pivoted DataFrame are the labels of the axes
+            digest.update(content_hash(value.index, value.columns).encode())
+        if hasattr(value, 'tocoo'):
+            digest.update(f'sparse{value.shape}'.encode())
+            value = np.concatenate([np.asarray(array, dtype=float) for array in sparse_triplets(value)])
+        array = np.asarray(value)
+        digest.update(f'{array.dtype.str}{array.shape}'.encode())
+        if array.dtype.hasobject:
+            digest.update(repr(array.tolist()).encode())
+        else:
+            digest.update(np.ascontiguousarray(array).tobytes())
+    for key, value in sorted(options.items()):
+        if hasattr(value, 'dtype') or hasattr(value, 'tocoo'):
+            # repr of long arrays and Series is cut off
+            value = content_hash(value)
+        digest.update(f'{key}={value!r};'.encode())
+    return digest.hexdigest()
+
+
+def figure_nbytes(fig: go.Figure | dict) -> int:
+    """
+    Approximate memory used by the data of a go.Figure or of a dict figure (output='dict')
+    """
+    return sum(
+        np.asarray(trace[key]).nbytes
+        for trace in fig['data']
+        for key in ('x', 'y', 'z', 'i', 'j', 'k')
+        if key in trace and trace[key] is not None
+    )
+
+
+def figure_json(x_df, y_df, z_df, compact=False, **kwargs) -> str:
+    """
+    JSON of plotly_bar_charts_3d(x_df, y_df, z_df, **kwargs)
+    :param compact: If True, serialize with to_compact_json instead of fig.to_json()
+    """
+    if kwargs.get('return_bars'):
+        raise ValueError('return_bars is not supported, only the figure is serialized')
+    fig = plotly_bar_charts_3d(x_df, y_df, z_df, **kwargs)
+    with phase('serialization'):
+        if compact:
+            return to_compact_json(fig)
+        # A dict figure of output='dict' is serialized without being validated
+        return pio.to_json(fig, validate=False) if isinstance(fig, dict) else fig.to_json()
+
+
+class FigureCache:
+    """
+    LRU cache of charts, keyed on a hash of the content of the data and of all the options
+    The least recently used entries are evicted when there are more than max_entries entries or when they
+    use more than max_bytes bytes, cached figures are shared and must not be modified
+    Example :
+        cache = FigureCache(max_entries=64, max_bytes=512 * 2 ** 20)
+        json_str = cache.json(xdf, ydf, zdf, color='x+y', merge_traces=True)
+        print(cache.stats)
+    """
+
+    def __init__(self, max_entries=128, max_bytes=256 * 2 ** 20):
+        """
+        :param max_entries: Maximum number of cached figures and JSON strings
+        :param max_bytes: Maximum memory used by the cached figures and JSON strings
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, create, size):
+        """
+        Cached value of key, created with create() and weighted with size(value) on a miss
+        """
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            self.misses += 1
+
+        value = create()
+        n_bytes = size(value)
+
+        with self.lock:
+            if key not in self.entries and n_bytes <= self.max_bytes:
+                self.entries[key] = (value, n_bytes)
+                self.n_bytes += n_bytes
+                while len(self.entries) > self.max_entries or self.n_bytes > self.max_bytes:
+                    _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                    self.n_bytes -= evicted_bytes
+                    self.evictions += 1
+        return value
+
+    def figure(self, x_df, y_df, z_df, **kwargs) -> go.Figure | dict:
+        """
+        Cached plotly_bar_charts_3d(x_df, y_df, z_df, **kwargs), a dict with output='dict'
+        """
+        if kwargs.get('return_bars'):
+            raise ValueError('return_bars is not supported, only figures are cached')
+        return self.get(
+            ('figure', content_hash(x_df, y_df, z_df, **kwargs)),
+            lambda: plotly_bar_charts_3d(x_df, y_df, z_df, **kwargs),
+            figure_nbytes,
         )
 
+    def json(self, x_df, y_df, z_df, compact=False, **kwargs) -> str:
+        """
+        Cached JSON of plotly_bar_charts_3d(x_df, y_df, z_df, **kwargs)
+        :param compact: If True, serialize with to_compact_json instead of fig.to_json()
+        """
+        return self.get(
+            ('json', compact, content_hash(x_df, y_df, z_df, **kwargs)),
+            partial(figure_json, x_df, y_df, z_df, compact, **kwargs),
+            len,
+        )
+
+    @property
+    def stats(self) -> dict:
+        """
+        Hits, misses, evictions, number of entries and bytes used by the cache
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.n_bytes,
+            }
+
+    def clear(self):
+        """
+        Remove all the entries, statistics are kept
+        """
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+
+
+# Future of every JSON being built, by event loop and content_hash of the request
+json_in_flight: dict[tuple, asyncio.Future] = {}
+
+
+async def build_figure_json(x_df, y_df, z_df, compact=False, executor=None, cache=None, **kwargs) -> str:
+    """
+    JSON of plotly_bar_charts_3d(x_df, y_df, z_df, **kwargs) built in an executor, so the event loop keeps
+    serving other requests
+    Identical requests made while the JSON is being built wait for the same build instead of starting another
+    Example :
+        async def handle(request):
+            return web.Response(text=await build_figure_json(xdf, ydf, zdf, merge_traces=True))
+    :param compact: If True, serialize with to_compact_json instead of fig.to_json()
+    :param executor: concurrent.futures executor of the builds, the default executor of the loop if None
+    :param cache: FigureCache keeping the JSON of previous requests, for thread executors
+    :return: JSON of the figure
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    key = (loop, compact, content_hash(x_df, y_df, z_df, **kwargs))
+
+    future = json_in_flight.get(key)
+    if future is None:
+        if cache is None:
+            build = partial(figure_json, x_df, y_df, z_df, compact, **kwargs)
+        else:
+            build = partial(cache.json, x_df, y_df, z_df, compact, **kwargs)
+        future = loop.run_in_executor(executor, build)
+        json_in_flight[key] = future
+        future.add_done_callback(lambda _: json_in_flight.pop(key, None))
+
+    # A cancelled request must not cancel the build awaited by identical requests
+    return await asyncio.shield(future)
+
+
+def init_render_worker(template):
+    """
+    Initialize a process of render_many with the layout template resolved by the parent process and warm
+    up the plotly validators, so every chart of the worker reuses them
+    """
+    pio.templates['plotly_white'] = template
+    plotly_bar_charts_3d([0], [0], [1]).to_json()
+
+
+def render_chart(spec, out_dir):
+    """
+    Build a chart and write it to out_dir
+    :param spec: dict with x, y and z data, and optionally name (file name without extension), format
+                 (html, json, compact_json or any image format of fig.write_image) and options (dict of
+                 keyword arguments of plotly_bar_charts_3d)
+    :param out_dir: Directory of the written file
+    :return: dict with name, path, build and write time in seconds and size in bytes of the file
+    """
+    start = time.perf_counter()
+    fig = plotly_bar_charts_3d(spec['x'], spec['y'], spec['z'], **spec.get('options', {}))
+    build_time = time.perf_counter() - start
+
+    file_format = spec.get('format', 'html')
+    extension = 'json' if file_format == 'compact_json' else file_format
+    path = os.path.join(out_dir, f'{spec["name"]}.{extension}')
+    with phase('serialization'):
+        # Figures are validated when they are built, dict figures of output='dict' are written as they are
+        if file_format == 'html':
+            pio.write_html(fig, path, include_plotlyjs='cdn', validate=False)
+        elif file_format == 'json':
+            pio.write_json(fig, path, validate=False)
+        elif file_format == 'compact_json':
+            with open(path, 'w') as file:
+                file.write(to_compact_json(fig))
+        else:
+            pio.write_image(fig, path, format=file_format, validate=False)
+    write_time = time.perf_counter() - start - build_time
+
+    return {
+        'name': spec['name'],
+        'path': path,
+        'build_s': build_time,
+        'write_s': write_time,
+        'bytes': os.path.getsize(path),
+    }
+
+
+def render_many(specs, out_dir, workers=None):
+    """
+    Build and write many charts in parallel across a pool of processes
+    Every worker writes its charts to disk as soon as they are built, only timings are sent back
+    Example :
+        specs = [dict(name=f'report_{i}', x=xdf, y=ydf, z=zdf, options=dict(color='x+y')) for ...]
+        timings = render_many(specs, 'reports', workers=8)
+    :param specs: Iterable of chart specifications, see render_chart, charts without name are numbered
+    :param out_dir: Directory of the written files, created if needed
+    :param workers: Number of processes, os.cpu_count() if None
+    :return: list of the timings of render_chart, in the order of specs
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    specs = [{'name': f'chart_{index}', **spec} for index, spec in enumerate(specs)]
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_render_worker,
+        initargs=(pio.templates['plotly_white'],),
+    ) as executor:
+        futures = [executor.submit(render_chart, spec, out_dir) for spec in specs]
+        return [future.result() for future in futures]
+
 
 if __name__ == '__main__':
+    import pandas as pd
+
     # Example 1, 2x2 grid full
     xdf = pd.Series([1, 10])
     ydf = pd.Series([2, 4])
@@ -658,11 +2098,11 @@ if __name__ == '__main__':
     ).show()
 
     # Example 3, 5x5 grid with 25 values
-    df = pd.read_csv('examples/dataExample.csv')
-    fig = plotly_bar_charts_3d(
-        df['Gamma'],
-        df['C'],
-        df['score 1'],
+    fig = bar_chart_from_csv(
+        'examples/dataExample.csv',
+        'Gamma',
+        'C',
+        'score 1',
         x_title='Gamma',
         y_title='C',
         color='y',
@@ -0,0 +1,234 @@
+"""
+Export of bar charts as static images and as lean HTML pages
+
+fig.write_image starts a headless browser for every image, ImageExporter starts it once and renders the charts
+by batches on several tabs
+Needs the plotly and kaleido of requirements.txt (plotly.io.write_images needs plotly >= 6.1 with kaleido >= 1)
+and Chrome, installed with :
+    pip install -r requirements.txt
+    plotly_get_chrome
+Example :
+    specs = [dict(name=f'report_{i}', x=xdf, y=ydf, z=zdf) for ...]
+    with ImageExporter(tabs=4) as exporter:
+        paths = exporter.write_charts(specs, 'reports', image_format='png')
+
+fig.write_html embeds the whole plotly.js bundle and the trace arrays as lists of numbers in every file,
+write_lean_html references the plotly.js gl3d bundle from a CDN, writes the arrays as typed arrays and only
+draws a chart when it is scrolled into view
+Example :
+    figs = [plotly_bar_charts_3d(xdf, ydf, zdf, merge_traces=True) for ...]
+    write_lean_html(figs, 'report.html')
+"""
+from __future__ import annotations
+
+import html
+import os
+import re
+
+import plotly.io as pio
+
+from barchart import plotly_bar_charts_3d
+from barchart import to_compact_json
+
+# First plotly.js decoding the typed arrays written by to_compact_json
+MIN_PLOTLYJS_VERSION = (2, 28, 0)
+LEAN_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="{plotlyjs}" defer></script>
+</head>
+<body>
+{charts}
+<script>
+document.addEventListener('DOMContentLoaded', function () {{
+    var config = {config};
+    function draw(div) {{
+        var fig = JSON.parse(document.getElementById(div.id + '-figure').textContent);
+        Plotly.newPlot(div, fig.data, fig.layout, config);
+    }}
+    var divs = document.querySelectorAll('div.barchart3d');
+    if (!{lazy} || !('IntersectionObserver' in window)) {{
+        divs.forEach(draw);
+        return;
+    }}
+    var observer = new IntersectionObserver(function (entries) {{
+        entries.forEach(function (entry) {{
+            if (entry.isIntersecting) {{
+                observer.unobserve(entry.target);
+                draw(entry.target);
+            }}
+        }});
+    }}, {{rootMargin: '200px'}});
+    divs.forEach(function (div) {{ observer.observe(div); }});
+}});
+</script>
+</body>
+</html>
+"""
+LEAN_HTML_CHART = """<div class="barchart3d" id="{div_id}" style="width: 100%; height: {height};"></div>
+<script type="application/json" id="{div_id}-figure">{figure}</script>"""
+
+
+class ImageExporter:
+    """
+    Persistent kaleido session writing figures as PNG, SVG, PDF, JPEG or WEBP images by batches
+    """
+
+    def __init__(self, tabs=4, batch_size=32, **kaleido_kwargs):
+        """
+        :param tabs: Number of browser tabs rendering images in parallel
+        :param batch_size: Number of figures sent to kaleido at once, figures of write_charts are built one
+                           batch at a time
+        :param kaleido_kwargs: Other keyword arguments of kaleido.Kaleido, such as timeout
+        """
+        self.tabs = tabs
+        self.batch_size = batch_size
+        self.kaleido_kwargs = kaleido_kwargs
+        self.running = False
+
+    def start(self):
+        """
+        Start the browser of kaleido, every export until stop is rendered by it
+        """
+        import kaleido
+
+        if not self.running:
+            kaleido.start_sync_server(n=self.tabs, silence_warnings=True, **self.kaleido_kwargs)
+            self.running = True
+
+    def stop(self):
+        """
+        Close the browser of kaleido
+        """
+        import kaleido
+
+        if self.running:
+            kaleido.stop_sync_server(silence_warnings=True)
+            self.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def write_images(self, figures, paths, image_format=None, width=None, height=None, scale=None):
+        """
+        Write figures as images
+        :param figures: List of go.Figure
+        :param paths: List of paths, one per figure
+        :param image_format: png, svg, pdf, jpeg or webp, guessed from the extension of the paths if None
+        :param width: Width of the images in pixels, plotly default if None
+        :param height: Height of the images in pixels, plotly default if None
+        :param scale: Scale factor of the images, plotly default if None
+        """
+        if len(figures) != len(paths):
+            raise ValueError(f'Expected one path per figure, received {len(paths)} paths for {len(figures)} figures')
+        if not hasattr(pio, 'write_images'):
+            raise ImportError('ImageExporter needs plotly.io.write_images, pip install -r requirements.txt')
+
+        for start in range(0, len(figures), self.batch_size):
+            pio.write_images(
+                figures[start:start + self.batch_size],
+                paths[start:start + self.batch_size],
+                format=image_format,
+                width=width,
+                height=height,
+                scale=scale,
+                # Figures are validated when they are built
+                validate=False,
+            )
+
+    def write_charts(self, specs, out_dir, image_format='png', width=None, height=None, scale=None):
+        """
+        Build charts with merged traces, which render much faster, and write them as images
+        :param specs: Iterable of chart specifications as for barchart.render_many, dict with x, y and z data,
+                      and optionally name (file name without extension, charts without name are numbered) and
+                      options (dict of keyword arguments of plotly_bar_charts_3d)
+        :param out_dir: Directory of the images, created if needed
+        :param image_format: png, svg, pdf, jpeg or webp
+        :param width: Width of the images in pixels, plotly default if None
+        :param height: Height of the images in pixels, plotly default if None
+        :param scale: Scale factor of the images, plotly default if None
+        :return: list of paths of the images, in the order of specs
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        figures = []
+        batch_paths = []
+
+        for index, spec in enumerate(specs):
+            options = {'merge_traces': True, **spec.get('options', {})}
+            figures.append(plotly_bar_charts_3d(spec['x'], spec['y'], spec['z'], **options))
+            batch_paths.append(os.path.join(out_dir, f'{spec.get("name", f"chart_{index}")}.{image_format}'))
+
+            if len(figures) == self.batch_size:
+                self.write_images(figures, batch_paths, image_format, width, height, scale)
+                paths += batch_paths
+                figures, batch_paths = [], []
+
+        if figures:
+            self.write_images(figures, batch_paths, image_format, width, height, scale)
+            paths += batch_paths
+
+        return paths
+
+
+def plotlyjs_gl3d_url():
+    """
+    CDN address of the plotly.js partial bundle with 3D traces, of the version used by the installed plotly,
+    or of MIN_PLOTLYJS_VERSION for an older plotly.js which cannot decode the typed arrays of to_compact_json
+    """
+    from plotly.offline import get_plotlyjs_version
+
+    version = get_plotlyjs_version()
+    if tuple(int(part) for part in re.findall(r'\d+', version)[:3]) < MIN_PLOTLYJS_VERSION:
+        version = '.'.join(str(part) for part in MIN_PLOTLYJS_VERSION)
+    return f'https://cdn.plot.ly/plotly-gl3d-{version}.min.js'
+
+
+def to_lean_html(figures, plotlyjs=None, lazy=True, height='600px', config=None, title='') -> str:
+    """
+    HTML page of one or several figures referencing a shared plotly.js instead of embedding it
+    Mesh3d arrays are written as typed arrays with to_compact_json, figures are parsed and drawn only when
+    their div comes close to the viewport if lazy is True
+    :param figures: go.Figure or list of go.Figure, build them with merge_traces=True for lighter pages
+    :param plotlyjs: URL of plotly.js >= 2.28, the gl3d partial bundle of plotlyjs_gl3d_url if None
+    :param lazy: If True, draw every chart when it is scrolled into view, else all of them when the page loads
+    :param height: CSS height of every chart
+    :param config: dict of plotly.js configuration options, such as {'displayModeBar': False}
+    :param title: Title of the page
+    :return: HTML page
+    """
+    if not isinstance(figures, (list, tuple)):
+        figures = [figures]
+
+    charts = '\n'.join(
+        LEAN_HTML_CHART.format(
+            div_id=f'barchart3d-{index}',
+            height=height,
+            # A JSON string cannot close the script element holding it
+            figure=to_compact_json(fig).replace('</', '<\\/'),
+        )
+        for index, fig in enumerate(figures)
+    )
+    return LEAN_HTML.format(
+        title=html.escape(title),
+        plotlyjs=html.escape(plotlyjs or plotlyjs_gl3d_url()),
+        charts=charts,
+        config=pio.json.to_json_plotly(config or {}),
+        lazy='true' if lazy else 'false',
+    )
+
+
+def write_lean_html(figures, path, **kwargs):
+    """
+    Write to_lean_html(figures, **kwargs) to path
+    :return: size of the file in bytes
+    """
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(to_lean_html(figures, **kwargs))
+    return os.path.getsize(path)
@@ -0,0 +1,245 @@
+"""
+Benchmarks of plotly_bar_charts_3d
+Time and peak memory of the figure construction and of its serialization with fig.to_json()
+for full grid, paired and sparse inputs of growing size, and images per second of the static export
+Run with :
+    python bench_barchart.py
+    python bench_barchart.py --sizes 10 100 --repeat 5
+    python bench_barchart.py --images 50
+    python bench_barchart.py --clients 200
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+
+from barchart import build_figure_json
+from barchart import figure_json
+from barchart import plotly_bar_charts_3d
+
+SIZES = (10, 50, 100, 200, 500)
+# Drawing one Mesh3d per bar is too slow to be benchmarked on big grids
+MAX_SEPARATE_TRACES = 2_500
+
+
+def full_grid_input(size):
+    """
+    size x size grid given as CSV-like columns, x is repeated and y varies first
+    """
+    rng = np.random.default_rng(0)
+    x = np.repeat(np.arange(size), size)
+    y = np.tile(np.arange(size), size)
+    z = rng.random(size * size) + 1
+    return x, y, z
+
+
+def paired_input(size):
+    """
+    size * size - 1 (x, y, z) points, the missing point prevents the full grid detection
+    """
+    x, y, z = full_grid_input(size)
+    return x[:-1], y[:-1], z[:-1]
+
+
+def sparse_input(size, density=0.1):
+    """
+    size x size array flattened with NaN for empty cells, about density of the cells have a value
+    """
+    rng = np.random.default_rng(0)
+    z = rng.random(size * size) + 1
+    z[rng.random(size * size) > density] = np.nan
+    z[0] = 1
+    return np.arange(size), np.arange(size), z
+
+
+INPUTS = {
+    'full grid': full_grid_input,
+    'paired': paired_input,
+    'sparse': sparse_input,
+}
+
+
+def measure(function, *args, repeat=1, **kwargs):
+    """
+    Run function repeat times without tracing to get the best wall time, then once with tracemalloc
+    :return: result of the function, best wall time in seconds and peak of allocated memory in bytes
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, min(durations), peak
+
+
+def run_benchmarks(sizes=SIZES, repeat=1, inputs=INPUTS):
+    """
+    Benchmark every input kind at every size, with and without merge_traces
+    :return: list of results, one dict per benchmark
+    """
+    results = []
+    for name, make_input in inputs.items():
+        for size in sizes:
+            x, y, z = make_input(size)
+            for merge_traces in (False, True):
+                if not merge_traces and len(z) > MAX_SEPARATE_TRACES:
+                    continue
+                fig, build_time, build_peak = measure(
+                    plotly_bar_charts_3d, x, y, z, merge_traces=merge_traces, repeat=repeat,
+                )
+                json_str, json_time, json_peak = measure(fig.to_json, repeat=repeat)
+                results.append(
+                    dict(
+                        input=name,
+                        size=f'{size}x{size}',
+                        merge_traces=merge_traces,
+                        traces=len(fig.data),
+                        build_s=build_time,
+                        build_peak_mb=build_peak / 2 ** 20,
+                        json_s=json_time,
+                        json_peak_mb=json_peak / 2 ** 20,
+                        json_mb=len(json_str) / 2 ** 20,
+                    ),
+                )
+    return results
+
+
+def import_time(module='barchart', repeat=5):
+    """
+    Best time to import module in a new interpreter, in seconds
+    """
+    code = f'import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+    return min(
+        float(
+            subprocess.run(
+                [sys.executable, '-c', code],
+                capture_output=True,
+                check=True,
+                text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            ).stdout,
+        )
+        for _ in range(repeat)
+    )
+
+
+def image_export_rate(n_images=20, size=20, tabs=4, image_format='png'):
+    """
+    Images per second written with one fig.write_image per chart and with a single ImageExporter session
+    Needs kaleido and Chrome
+    :return: list of results, one dict per export method
+    """
+    from barchart_export import ImageExporter
+
+    x, y, z = full_grid_input(size)
+    specs = [dict(name=f'chart_{i}', x=x, y=y, z=z + i) for i in range(n_images)]
+    results = []
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        for spec in specs:
+            fig = plotly_bar_charts_3d(spec['x'], spec['y'], spec['z'], merge_traces=True)
+            fig.write_image(os.path.join(out_dir, f'{spec["name"]}.{image_format}'))
+        results.append(dict(method='fig.write_image', images=n_images, seconds=time.perf_counter() - start))
+
+        start = time.perf_counter()
+        with ImageExporter(tabs=tabs) as exporter:
+            exporter.write_charts(specs, out_dir, image_format=image_format)
+        results.append(dict(method=f'ImageExporter({tabs} tabs)', images=n_images, seconds=time.perf_counter() - start))
+
+    for result in results:
+        result['images_per_s'] = result['images'] / result['seconds']
+    return results
+
+
+def concurrent_clients(n_clients=200, n_charts=4, size=50):
+    """
+    Serve n_clients concurrent requests for n_charts different charts of size x size bars, built in the default
+    executor of the event loop one request at a time and with build_figure_json coalescing identical requests
+    :return: list of results, one dict per serving method
+    """
+    inputs = [full_grid_input(size) for _ in range(n_charts)]
+    inputs = [(x, y, z + chart) for chart, (x, y, z) in enumerate(inputs)]
+
+    async def one_build_per_request(x, y, z):
+        return await asyncio.get_running_loop().run_in_executor(None, partial(figure_json, x, y, z, merge_traces=True))
+
+    async def coalesced(x, y, z):
+        return await build_figure_json(x, y, z, merge_traces=True)
+
+    async def timed(request, x, y, z):
+        start = time.perf_counter()
+        await request(x, y, z)
+        return time.perf_counter() - start
+
+    async def serve(request):
+        return await asyncio.gather(*(timed(request, *inputs[client % n_charts]) for client in range(n_clients)))
+
+    results = []
+    for method, request in (('one build per request', one_build_per_request), ('build_figure_json', coalesced)):
+        start = time.perf_counter()
+        latencies = asyncio.run(serve(request))
+        seconds = time.perf_counter() - start
+        results.append(
+            dict(
+                method=method,
+                clients=n_clients,
+                seconds=seconds,
+                requests_per_s=n_clients / seconds,
+                mean_latency_s=float(np.mean(latencies)),
+            ),
+        )
+    return results
+
+
+def format_results(results):
+    """
+    Format the results as a text table
+    """
+    columns = list(results[0]) if results else []
+    rows = [columns] + [
+        [f'{value:.3f}' if isinstance(value, float) else str(value) for value in result.values()]
+        for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(columns))]
+    return '\n'.join(
+        '  '.join(cell.rjust(width) for cell, width in zip(row, widths))
+        for row in rows
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark plotly_bar_charts_3d')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='side of the grids')
+    parser.add_argument('--repeat', type=int, default=1, help='number of timed runs, the best is kept')
+    parser.add_argument('--images', type=int, default=0, help='number of images of the export benchmark, 0 to skip')
+    parser.add_argument('--clients', type=int, default=0, help='number of concurrent requests to serve, 0 to skip')
+    args = parser.parse_args()
+
+    print(f'import barchart: {import_time():.3f} s')
+    print(format_results(run_benchmarks(args.sizes, args.repeat)))
+    if args.images:
+        print(format_results(image_export_rate(args.images)))
+    if args.clients:
+        print(format_results(concurrent_clients(args.clients)))
+
+
+if __name__ == '__main__':
+    main()
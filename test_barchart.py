@@ -1,13 +1,69 @@
 from __future__ import annotations
 
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
+import plotly.graph_objects as go
 import pytest
 
+from barchart import aggregate_csv
+from barchart import bar_chart_from_csv
+from barchart import bar_charts_from_paired_data
+from barchart import bar_charts_from_sparse_array
+from barchart import bar_charts_from_sparse_matrix
+from barchart import BarChart3D
+from barchart import BarGrid
+from barchart import BOX_FACES
+from barchart import box_geometry
+from barchart import build_figure_json
+from barchart import compact_json_saving
+from barchart import content_hash
+from barchart import cull_hidden_faces
+from barchart import decode_typed_array
+from barchart import detect_layout
+from barchart import figure_json
+from barchart import figure_nbytes
+from barchart import FigureCache
+from barchart import generate_mesh
+from barchart import grid_geometry
+from barchart import grid_level_of_detail
+from barchart import level_of_detail
+from barchart import named_palette
+from barchart import phase
 from barchart import plotly_bar_charts_3d
+from barchart import plotly_bar_charts_3d_animation
+from barchart import profile_phases
+from barchart import render_many
+from barchart import to_compact_json
+from barchart import UNIT_BOX_VERTICES
 from barchart import verify_input
 
 
+class TestImport:
+    """Test the cost of importing barchart"""
+
+    def test_import_does_not_load_pandas_and_plotly_express(self):
+        """Test that importing barchart does not import pandas, plotly.express and asyncio"""
+        code = 'import sys, barchart; print(sorted({"asyncio", "pandas", "plotly.express"} & set(sys.modules)))'
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            capture_output=True,
+            check=True,
+            cwd=Path(__file__).parent,
+            text=True,
+        )
+        assert result.stdout.strip() == '[]'
+
+
 class TestInputValidation:
     """Test input validation logic"""
 
@@ -58,6 +114,13 @@ class TestDataTypeDetection:
         # Should create exactly 5 meshes for 5 data points
         assert len(fig.data) == 5
 
+    def test_mixed_types_are_different_categories(self):
+        """Test that 1 and '1' are two x values"""
+        layout = detect_layout([1, 1, '1', '1'], [3, 4, 3, 4], [1, 2, 3, 4])
+
+        assert layout.mode == 'grid'
+        assert list(layout.x_uniques) == [1, '1']
+
     def test_detects_sparse_array(self):
         """Test detection of sparse array data"""
         x = [1, 10]
@@ -68,6 +131,29 @@ class TestDataTypeDetection:
         # Should create 4 meshes for a 2x2 sparse array
         assert len(fig.data) == 4
 
+    def test_detect_layout_modes(self):
+        """Test the mode found by detect_layout"""
+        assert detect_layout([1, 1, 2, 2], [3, 4, 3, 4], [1, 2, 3, 4]).mode == 'grid'
+        assert detect_layout([1, 2, 3], [4, 5, 6], [1, 2, 3]).mode == 'paired'
+        assert detect_layout([1, 10], [2, 4], [10, 30, 20, 45]).mode == 'sparse'
+
+    def test_detect_layout_repeated_pair_is_paired(self):
+        """Test that as many points as grid cells but with a repeated (x, y) pair is not a full grid"""
+        layout = detect_layout([1, 1, 2, 2], [3, 3, 3, 4], [1, 2, 3, 4])
+        assert layout.mode == 'paired'
+
+        fig = plotly_bar_charts_3d([1, 1, 2, 2], [3, 3, 3, 4], [1, 2, 3, 4])
+        assert len(fig.data) == 4
+
+    def test_detect_layout_codes(self):
+        """Test that codes index the unique values in order of appearance"""
+        layout = detect_layout(['b', 'b', 'a', 'a'], [3, 4, 3, 4], [1, 2, 3, 4])
+
+        assert list(layout.x_uniques) == ['b', 'a']
+        assert list(layout.x_codes) == [0, 0, 1, 1]
+        assert list(layout.y_uniques) == [3, 4]
+        assert list(layout.y_codes) == [0, 1, 0, 1]
+
 
 class TestBarPositioning:
     """Test that bars are positioned correctly"""
@@ -170,6 +256,86 @@ class TestColorSchemes:
         colors = [mesh.color for mesh in fig.data]
         assert len(set(colors)) == 3
 
+    def test_paired_color_follows_sorted_values(self):
+        """Test that paired data colors follow the sorted unique values"""
+        x = [10, 2, 10, 5]
+        y = [1, 2, 3, 4]
+        z = [10, 20, 30, 40]
+
+        fig = plotly_bar_charts_3d(x, y, z, color='x')
+        colors = [mesh.color for mesh in fig.data]
+
+        # x=2 is the first sorted value, then x=5 and x=10
+        assert colors[1] == '#636EFA'
+        assert colors[3] == '#EF553B'
+        assert colors[0] == colors[2] == '#00CC96'
+        assert [mesh.x[0] for mesh in fig.data] == [4, 0, 4, 2]
+
+    def test_every_palette_color_is_used(self):
+        """Test that categories cycle through all the colors of the palette"""
+        fig = plotly_bar_charts_3d(list(range(12)), [1], list(range(1, 13)), color='x')
+
+        colors = [mesh.color for mesh in fig.data]
+        assert len(set(colors)) == 10
+        assert colors[9] == '#FECB52'
+        assert colors[10] == colors[0]
+
+    @pytest.mark.parametrize(
+        'x, y, z',
+        [
+            (np.repeat(np.arange(3), 10), np.tile(np.arange(10), 3), np.arange(1, 31)),
+            (None, None, np.arange(1, 31).reshape(3, 10)),
+        ],
+    )
+    def test_xy_neighbours_differ(self, x, y, z):
+        """Test that x+y gives neighbouring bars different colors when a side is a multiple of the palette"""
+        fig = plotly_bar_charts_3d(x, y, z, color='x+y')
+
+        colors = {(mesh.x[0], mesh.y[0]): mesh.color for mesh in fig.data}
+        assert len(colors) == 30
+        for (bar_x, bar_y), bar_color in colors.items():
+            for neighbour in ((bar_x + 2, bar_y), (bar_x, bar_y + 2)):
+                assert colors.get(neighbour) != bar_color
+
+    def test_palette(self):
+        """Test that a palette is given by its plotly name or as a list of colors"""
+        x, y, z = [1, 2, 3], [4, 5, 6], [1, 2, 3]
+
+        named = plotly_bar_charts_3d(x, y, z, palette='Set1')
+        listed = plotly_bar_charts_3d(x, y, z, palette=['red', 'blue'])
+
+        assert [mesh.color for mesh in named.data] == list(named_palette('Set1')[:3])
+        assert [mesh.color for mesh in listed.data] == ['red', 'blue', 'red']
+        with pytest.raises(ValueError, match='Unknown palette'):
+            plotly_bar_charts_3d(x, y, z, palette='Unknown')
+
+    def test_named_palettes_are_cached(self):
+        """Test that a named palette is looked up once"""
+        named_palette.cache_clear()
+        for _ in range(3):
+            plotly_bar_charts_3d([1, 2], [1, 2], [1, 2], palette='D3')
+
+        assert named_palette.cache_info().hits == 2
+        assert named_palette.cache_info().misses == 1
+
+    def test_color_by_height(self):
+        """Test that color z draws merged bars colored by their height through the intensity"""
+        fig = plotly_bar_charts_3d([1, 2, 3], [4, 5, 6], [1, 5, 3], color='z', colorscale='Blues', merge_traces=True)
+
+        assert len(fig.data) == 1
+        mesh = fig.data[0]
+        assert mesh.color is None
+        np.testing.assert_array_equal(mesh.intensity, np.repeat([1, 5, 3], 8))
+        assert (mesh.cmin, mesh.cmax) == (1, 5)
+        assert mesh.colorscale[0][1] == 'rgb(247,251,255)'
+
+    def test_color_by_height_shares_the_range(self):
+        """Test that separate traces colored by height share one color range and one color bar"""
+        fig = plotly_bar_charts_3d([1, 10], [2, 4], [10, 30, 20, 45], color='z')
+
+        assert {(mesh.cmin, mesh.cmax) for mesh in fig.data} == {(10, 45)}
+        assert [mesh.showscale for mesh in fig.data] == [True, False, False, False]
+
 
 class TestArrayHandling:
     """Test handling of arrays"""
@@ -207,6 +373,146 @@ class TestArrayHandling:
         assert set(z_values) == expected_values
 
 
+class TestSparseMatrix:
+    """Test sparse matrices and (row, col, value) triplets"""
+
+    def test_triplets_only_draw_stored_values(self):
+        """Test that only the stored values are drawn, without transparent bars"""
+        x = [1, 2, 3, 4]
+        y = [10, 20, 30]
+
+        fig = bar_charts_from_sparse_matrix(x, y, ([0, 3], [2, 1], [64, 32]), z_min=0)
+
+        assert len(fig.data) == 2
+        assert all(mesh.opacity == 1 for mesh in fig.data)
+        assert [(mesh.x[0], mesh.y[0], mesh.z[4]) for mesh in fig.data] == [(0, 4, 64), (6, 2, 32)]
+        # Axes cover the empty rows and columns
+        assert fig.layout.scene.xaxis.range == (0, 7)
+        assert fig.layout.scene.yaxis.range == (0, 5)
+        assert fig.layout.scene.xaxis.ticktext == ('1', '2', '3', '4')
+
+    def test_scipy_sparse_matrix(self):
+        """Test that plotly_bar_charts_3d accepts scipy.sparse matrices"""
+        sparse = pytest.importorskip('scipy.sparse')
+        z = sparse.csr_matrix(np.array([[0, 5, 0], [0, 0, 0], [7, 0, 0], [0, 0, 9]]))
+
+        fig = plotly_bar_charts_3d([1, 2, 3, 4], [10, 20, 30], z, merge_traces=True)
+        triplets_fig = bar_charts_from_sparse_matrix(
+            [1, 2, 3, 4], [10, 20, 30], ([0, 2, 3], [1, 0, 2], [5, 7, 9]), merge_traces=True,
+        )
+
+        assert sum(len(mesh.x) for mesh in fig.data) == 3 * 8
+        assert fig == triplets_fig
+
+    def test_shape_and_indices_are_checked(self):
+        """Test that a matrix or triplets larger than the labels, or without values, raise ValueError"""
+        sparse = pytest.importorskip('scipy.sparse')
+
+        with pytest.raises(ValueError, match='shape'):
+            plotly_bar_charts_3d([1, 2], [10, 20], sparse.csr_matrix(np.ones((3, 2))))
+        with pytest.raises(ValueError, match='Rows must be'):
+            bar_charts_from_sparse_matrix([1, 2], [10, 20], ([0, 2], [1, 0], [5, 7]))
+        with pytest.raises(ValueError, match='no stored value'):
+            plotly_bar_charts_3d([1, 2], [10, 20], sparse.csr_matrix((2, 2)))
+
+    @pytest.mark.parametrize(
+        'x, y, z',
+        [
+            ((0, 1, 2), (0, 1, 2), (10, 20, 30)),
+            ((2, 3, 5, 10), (31, 24, 10, 28), (1, 2, 3, 4)),
+            ((1, 1, 2, 2), (3, 4, 3, 4), (1, 2, 3, 4)),
+        ],
+    )
+    def test_tuples_are_not_triplets(self, x, y, z):
+        """Test that tuples given to plotly_bar_charts_3d are drawn like lists"""
+        fig = plotly_bar_charts_3d(x, y, z, merge_traces=True)
+
+        assert fig == plotly_bar_charts_3d(list(x), list(y), list(z), merge_traces=True)
+
+
+class TestBarGrid:
+    """Test the common form of the data of every layout"""
+
+    def test_layouts(self):
+        """Test the codes and labels of full grid, paired, flattened sparse and 2D data"""
+        full = BarGrid.from_data([2, 2, 1, 1], [3, 4, 3, 4], [1, 2, 3, 4])
+        paired = BarGrid.from_data([2, 1, 3], [5, 4, 6], [1, 2, 3])
+        flattened = BarGrid.from_data([1, 2], [3, 4, 5], [1, np.nan, 3, 4, 5, 6])
+        grid = BarGrid.from_data(None, None, np.arange(6.0).reshape(2, 3))
+
+        assert list(full.x_codes) == [0, 0, 1, 1] and list(full.x_labels) == [2, 1]
+        assert list(paired.x_codes) == [1, 0, 2] and list(paired.y_codes) == [1, 0, 2]
+        assert list(flattened.x_codes) == [0, 1, 0, 1, 0, 1] and list(flattened.y_codes) == [0, 0, 1, 1, 2, 2]
+        assert np.isnan(flattened.z[1])
+        assert list(grid.x_codes) == [0, 1, 2, 0, 1, 2] and list(grid.y_codes) == [0, 0, 0, 1, 1, 1]
+
+    def test_grid_memory_is_shared(self):
+        """Test that the values of a 2D float32 grid are not copied and float32 values stay float32"""
+        z = np.ones((100, 100), dtype=np.float32)
+
+        grid = BarGrid.from_data(None, None, z)
+
+        assert np.shares_memory(grid.z, z)
+        assert BarGrid.from_data([1, 2], [3, 4], z[0, :4]).z.dtype == np.float32
+        assert grid.nbytes / len(grid) <= 25
+        assert not hasattr(grid, '__dict__')
+
+    def test_draw(self):
+        """Test that a BarGrid is drawn like the sparse matrix of its cells"""
+        grid = BarGrid([0, 2], [1, 0], [5.0, 7.0], ['a', 'b', 'c'], ['d', 'e'])
+
+        fig = plotly_bar_charts_3d(None, None, grid, merge_traces=True)
+
+        triplets = ([0, 2], [1, 0], [5, 7])
+        assert fig == bar_charts_from_sparse_matrix(['a', 'b', 'c'], ['d', 'e'], triplets, merge_traces=True)
+        assert content_hash(grid) == content_hash(BarGrid([0, 2], [1, 0], [5.0, 7.0], ['a', 'b', 'c'], ['d', 'e']))
+        assert content_hash(grid) != content_hash(BarGrid([0, 2], [1, 0], [5.0, 8.0], ['a', 'b', 'c'], ['d', 'e']))
+
+
+class TestGridInput:
+    """Test 2D ndarray and pivoted DataFrame input"""
+
+    def test_ndarray_positions(self):
+        """Test that z[i, j] is drawn at the i-th y position and the j-th x position"""
+        z = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+
+        fig = plotly_bar_charts_3d(None, None, z, z_min=0)
+
+        assert len(fig.data) == 6
+        assert [(mesh.x[0], mesh.y[0], mesh.z[4]) for mesh in fig.data[:4]] == [
+            (0, 0, 1), (2, 0, 2), (4, 0, 3), (0, 2, 4),
+        ]
+        assert fig.layout.scene.xaxis.ticktext == ('0', '1', '2')
+        assert fig.layout.scene.yaxis.ticktext == ('0', '1')
+
+    def test_pivot_matches_paired_data(self):
+        """Test that a DataFrame pivoted with index=y and columns=x draws the same bars as the columns"""
+        df = pd.DataFrame({'x': [1, 1, 2, 2, 3, 3], 'y': [10, 20, 10, 20, 10, 20], 'z': [1, 2, 3, 4, 5, 6]})
+        pivot = df.pivot(index='y', columns='x', values='z')
+
+        grid_fig = plotly_bar_charts_3d(None, None, pivot, merge_traces=True, color='x')
+        paired_fig = bar_charts_from_paired_data(df['x'], df['y'], df['z'], merge_traces=True, color='x')
+
+        assert grid_fig.layout == paired_fig.layout
+        for grid_mesh, paired_mesh in zip(grid_fig.data, paired_fig.data):
+            assert grid_mesh.color == paired_mesh.color
+            assert sorted(zip(grid_mesh.x, grid_mesh.y, grid_mesh.z)) == sorted(
+                zip(paired_mesh.x, paired_mesh.y, paired_mesh.z),
+            )
+
+    def test_missing_cells_are_transparent(self):
+        """Test that NaN cells of the grid are drawn as transparent bars"""
+        fig = plotly_bar_charts_3d(['a', 'b'], ['c', 'd'], np.array([[1.0, np.nan], [2.0, 3.0]]))
+
+        assert [mesh.opacity for mesh in fig.data] == [1, 0.01, 1, 1]
+        assert fig.layout.scene.xaxis.ticktext == ('a', 'b')
+
+    def test_wrong_labels(self):
+        """Test that labels must match the shape of the grid"""
+        with pytest.raises(ValueError):
+            plotly_bar_charts_3d([1, 2, 3], None, np.ones((2, 2)))
+
+
 class TestAxisLabels:
     """Test that axis labels are set correctly"""
 
@@ -237,6 +543,617 @@ class TestAxisLabels:
         assert fig.layout.scene.yaxis.ticktext == ('100', '200', '300')
 
 
+class TestGeometry:
+    """Test the vectorized geometry of the bars"""
+
+    def test_grid_geometry_shapes(self):
+        """Test that every bar has 8 vertices and 12 triangles"""
+        vertices, faces = grid_geometry(np.ones((4, 3)))
+
+        assert vertices.shape == (96, 3)
+        assert faces.shape == (144, 3)
+        assert faces.max() == 95
+
+    def test_grid_geometry_matches_generate_mesh(self):
+        """Test that a bar of the grid has the same geometry as generate_mesh"""
+        z_grid = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+        vertices, faces = grid_geometry(z_grid, z_min=0.5, step=1)
+
+        # Bars are ordered by y position then x position, bar 4 is z_grid[1, 1]
+        mesh = generate_mesh(2, 3, 2, 3, 0.5, 4.0, 'red', True, 'z')
+        np.testing.assert_array_equal(vertices[32:40], np.column_stack([mesh.x, mesh.y, mesh.z]))
+        np.testing.assert_array_equal(faces[48:60] - 32, np.column_stack([mesh.i, mesh.j, mesh.k]))
+
+    def test_generate_mesh_corners(self):
+        """Test that generate_mesh places the 8 corners of a bar at its bounds"""
+        mesh = generate_mesh(0.1, 0.3, 1, 2, 0, 5, 'red', True, 'z')
+
+        assert list(mesh.x) == [0.1, 0.1, 0.3, 0.3, 0.1, 0.1, 0.3, 0.3]
+        assert list(mesh.y) == [1, 2, 2, 1, 1, 2, 2, 1]
+        assert list(mesh.z) == [0, 0, 0, 0, 5, 5, 5, 5]
+        assert list(mesh.i) == [7, 0, 0, 0, 4, 4, 6, 6, 4, 0, 3, 2]
+
+    def test_box_template_is_read_only(self):
+        """Test that the unit box template cannot be modified by the geometry of a chart"""
+        with pytest.raises(ValueError):
+            UNIT_BOX_VERTICES[0, 0] = 1
+        with pytest.raises(ValueError):
+            BOX_FACES[0, 0] = 1
+
+    def test_box_geometry_broadcasts_bounds(self):
+        """Test that scalar bounds are shared by every box"""
+        vertices, faces = box_geometry([0, 1], [1, 2], 0, 1, 0, [3, 4])
+
+        assert vertices.shape == (16, 3)
+        np.testing.assert_array_equal(faces[12:], BOX_FACES + 8)
+        np.testing.assert_array_equal(vertices[8:, 0], [1, 1, 2, 2, 1, 1, 2, 2])
+        np.testing.assert_array_equal(vertices[8:, 2], [0, 0, 0, 0, 4, 4, 4, 4])
+
+
+class TestCullHiddenFaces:
+    """Test the removal of the triangles that are never seen"""
+
+    def test_bottom_faces_are_removed(self):
+        """Test that the 2 bottom triangles of every bar are removed and the top ones kept"""
+        fig = plotly_bar_charts_3d([1, 1, 2, 2], [3, 4, 3, 4], [1, 2, 3, 4], merge_traces=True)
+
+        report = cull_hidden_faces(fig)
+
+        assert report == {'triangles': 48, 'visible_triangles': 40, 'ratio': 40 / 48}
+        for mesh in fig.data:
+            faces = np.column_stack([mesh.i, mesh.j, mesh.k])
+            assert not (faces % 8 < 4).all(axis=1).any()
+            assert (faces % 8 >= 4).all(axis=1).sum() == 2 * len(mesh.x) // 8
+
+    def test_empty_and_flat_bars(self):
+        """Test that bars without value keep no triangle and flat bars only their top"""
+        fig = plotly_bar_charts_3d([1, 2], [3, 4], [5, np.nan, 0, np.nan], z_min=0, output='dict')
+
+        report = cull_hidden_faces(fig)
+
+        assert report['visible_triangles'] == 10 + 2
+        assert sorted(len(trace['i']) for trace in fig['data']) == [0, 0, 2, 10]
+
+    def test_negative_bars_keep_their_cap(self):
+        """Test that bars going below z_min keep every face, their face on z_min is the visible one"""
+        fig = plotly_bar_charts_3d([1, 2], [3, 4], [-5, -10], z_min=0, merge_traces=True)
+
+        report = cull_hidden_faces(fig)
+
+        assert report['visible_triangles'] == report['triangles'] == 24
+
+
+class TestMergedTraces:
+    """Test the merge_traces mode drawing several bars in one Mesh3d"""
+
+    def test_full_grid_one_trace_per_color(self):
+        """Test that a full grid is drawn with one trace per color"""
+        x = [1, 1, 1, 2, 2, 2, 3, 3, 3]
+        y = [10, 20, 30, 10, 20, 30, 10, 20, 30]
+        z = list(range(1, 10))
+
+        fig = plotly_bar_charts_3d(x, y, z, color='x', merge_traces=True)
+
+        assert len(fig.data) == 3
+        assert len({mesh.color for mesh in fig.data}) == 3
+        # 3 bars of 8 vertices and 12 triangles per trace
+        for mesh in fig.data:
+            assert len(mesh.x) == 24
+            assert len(mesh.i) == 36
+            assert max(mesh.i) == 23
+
+    def test_same_geometry_as_separate_traces(self):
+        """Test that merged traces contain exactly the vertices of the separate traces"""
+        features = [2, 3, 5, 10, 20]
+        neighbours = [31, 24, 10, 28, 48]
+        accuracies = [0.9727, 0.9994, 0.9994, 0.9995, 0.9995]
+
+        fig = plotly_bar_charts_3d(features, neighbours, accuracies, color='y')
+        merged_fig = plotly_bar_charts_3d(
+            features, neighbours, accuracies, color='y', merge_traces=True,
+        )
+
+        def vertices(figure):
+            return sorted(
+                vertex
+                for mesh in figure.data
+                for vertex in zip(mesh.x, mesh.y, mesh.z)
+            )
+
+        assert vertices(merged_fig) == vertices(fig)
+        assert merged_fig.layout.scene == fig.layout.scene
+
+    def test_sparse_empty_cells_in_transparent_trace(self):
+        """Test that empty cells of a sparse array are kept in a transparent trace"""
+        x = [1, 2]
+        y = [3, 4]
+        z = [10, 20, 30]
+
+        fig = bar_charts_from_sparse_array(x, y, z, z_min=0, color='x+y', merge_traces=True)
+
+        opacities = sorted(mesh.opacity for mesh in fig.data)
+        assert opacities == [0.01, 1, 1, 1]
+
+
+class TestLevelOfDetail:
+    """Test the binning of categories to limit the number of bars"""
+
+    def test_max_bars_must_be_positive(self):
+        """Test that max_bars below 1 raises ValueError naming it"""
+        with pytest.raises(ValueError, match='max_bars'):
+            plotly_bar_charts_3d([1, 2], [1, 2], [1, 2, 3, 4], max_bars=0)
+
+    def test_number_of_bars_is_capped(self):
+        """Test that a big grid is drawn with at most max_bars bars"""
+        x = np.repeat(np.arange(100), 100)
+        y = np.tile(np.arange(100), 100)
+        z = np.arange(10000, dtype=float)
+
+        fig = plotly_bar_charts_3d(x, y, z, max_bars=100, merge_traces=True)
+
+        assert sum(len(mesh.x) for mesh in fig.data) // 8 == 100
+        assert fig.layout.scene.xaxis.ticktext[:2] == ('0 - 9', '10 - 19')
+        assert len(fig.layout.scene.yaxis.ticktext) == 10
+
+    @pytest.mark.parametrize(
+        'reducer, expected', [('mean', [2.5, 5.5]), ('max', [4, 6]), ('sum', [10, 11])],
+    )
+    def test_reducers(self, reducer, expected):
+        """Test that the values of a block are reduced with the chosen reducer"""
+        x = [1, 1, 2, 2, 3, 3]
+        y = [1, 2, 1, 2, 1, 2]
+        z = [1, 2, 3, 4, 5, 6]
+
+        x_legend, y_legend, (row, col, value) = level_of_detail(x, y, z, max_bars=2, reducer=reducer)
+
+        assert x_legend == ['1 - 2', '3']
+        assert y_legend == ['1 - 2']
+        assert list(row) == [0, 1]
+        assert list(col) == [0, 0]
+        assert list(value) == expected
+
+    def test_unknown_reducer_raises(self):
+        """Test that an unknown reducer raises ValueError"""
+        with pytest.raises(ValueError, match='Unknown reducer'):
+            plotly_bar_charts_3d([1, 2], [1, 2], [1, 2], max_bars=1, lod_reducer='median')
+
+    @pytest.mark.parametrize('reducer', ['mean', 'max', 'sum'])
+    def test_grid_tiles_match_columns(self, reducer):
+        """Test that a 2D grid reduced by tiles gives the same blocks as its x, y, z columns"""
+        rng = np.random.default_rng(0)
+        z = rng.random((23, 31))
+        z[rng.random(z.shape) < 0.3] = np.nan
+
+        columns = level_of_detail(np.tile(np.arange(31), 23), np.repeat(np.arange(23), 31), z.ravel(), 50, reducer)
+        tiles = grid_level_of_detail(None, None, z, 50, reducer, tile_bytes=1)
+
+        assert tiles[:2] == columns[:2]
+        for tiles_array, columns_array in zip(tiles[2], columns[2]):
+            np.testing.assert_allclose(tiles_array, columns_array)
+
+    def test_npy_path(self, tmp_path):
+        """Test that a .npy file is memory-mapped and drawn like the array it holds"""
+        z = np.arange(400, dtype=np.float32).reshape(20, 20)
+        np.save(tmp_path / 'z.npy', z)
+
+        fig = plotly_bar_charts_3d(None, None, tmp_path / 'z.npy', max_bars=16, merge_traces=True)
+
+        assert fig == plotly_bar_charts_3d(None, None, z, max_bars=16, merge_traces=True)
+        assert sum(len(mesh.x) for mesh in fig.data) // 8 == 16
+
+
+class TestCsv:
+    """Test the chunked CSV reading"""
+
+    CSV = 'x,y,z,other\n1,3,10,a\n1,4,20,b\n2,3,30,c\n1,3,40,d\n2,4,50,e\n2,3,60,f\n1,4,5,g\n'
+
+    @pytest.mark.parametrize(
+        'agg, expected',
+        [('mean', [25, 12.5, 45, 50]), ('sum', [50, 25, 90, 50]), ('max', [40, 20, 60, 50]), ('count', [2, 2, 2, 1])],
+    )
+    def test_aggregation_across_chunks(self, agg, expected):
+        """Test that values of a cell spread over several chunks are aggregated"""
+        x, y, z = aggregate_csv(io.StringIO(self.CSV), 'x', 'y', 'z', agg=agg, chunksize=2)
+
+        assert list(x) == [1, 1, 2, 2]
+        assert list(y) == [3, 4, 3, 4]
+        assert list(z) == expected
+
+    def test_same_chart_as_read_csv(self):
+        """Test that the chart is the same as with the whole file loaded"""
+        path = Path(__file__).parent / 'examples' / 'dataExample.csv'
+        df = pd.read_csv(path)
+
+        fig = bar_chart_from_csv(path, 'Gamma', 'C', 'score 1', chunksize=4, color='y')
+
+        assert fig == plotly_bar_charts_3d(df['Gamma'], df['C'], df['score 1'], color='y')
+
+    def test_unknown_aggregation_raises(self):
+        """Test that an unknown aggregation raises ValueError"""
+        with pytest.raises(ValueError, match='Unknown aggregation'):
+            aggregate_csv(io.StringIO(self.CSV), 'x', 'y', 'z', agg='median')
+
+
+class TestBarChart3D:
+    """Test the update of the heights of an existing chart"""
+
+    @pytest.mark.parametrize('merge_traces', [False, True])
+    def test_update_matches_new_chart(self, merge_traces):
+        """Test that updated heights give the same figure as a new chart"""
+        x = [1, 1, 1, 2, 2, 2]
+        y = [10, 20, 30, 10, 20, 30]
+
+        chart = BarChart3D(x, y, [1, 2, 3, 4, 5, 6], z_min=0, merge_traces=merge_traces)
+        chart.update_z([1, 2, 7, 4, 5, 8])
+        fig = plotly_bar_charts_3d(x, y, [1, 2, 7, 4, 5, 8], z_min=0, merge_traces=merge_traces)
+
+        for mesh, expected_mesh in zip(chart.figure.data, fig.data):
+            np.testing.assert_array_equal(mesh.z, expected_mesh.z)
+
+    def test_only_changed_traces_are_updated(self):
+        """Test that only the traces of the changed bars are restyled"""
+        chart = BarChart3D([1, 2, 3], [4, 5, 6], [10, 20, 30], z_min=0)
+
+        restyle_data, trace_indexes = chart.update_z([10, 25, 30])
+
+        assert trace_indexes == [1]
+        assert list(restyle_data['z'][0]) == [0, 0, 0, 0, 25, 25, 25, 25]
+        assert chart.update_z([10, 25, 30]) == ({'z': []}, [])
+
+    def test_update_intensity(self):
+        """Test that the intensity follows the new heights when bars are colored by height"""
+        chart = BarChart3D([1, 2, 3], [4, 5, 6], [10, 20, 30], color='z', merge_traces=True)
+
+        restyle_data, trace_indexes = chart.update_z([10, 25, 30])
+
+        assert trace_indexes == [0]
+        np.testing.assert_array_equal(restyle_data['intensity'][0], np.repeat([10, 25, 30], 8))
+        np.testing.assert_array_equal(chart.figure.data[0].intensity, np.repeat([10, 25, 30], 8))
+
+    def test_wrong_size_raises(self):
+        """Test that z values of another size raise ValueError"""
+        chart = BarChart3D([1, 2, 3], [4, 5, 6], [10, 20, 30])
+        with pytest.raises(ValueError, match='Expected 3 z values'):
+            chart.update_z([10, 20])
+
+    def test_max_bars_raises(self):
+        """Test that max_bars is refused, new heights would not be reduced to the blocks"""
+        with pytest.raises(ValueError, match='max_bars'):
+            BarChart3D([1, 2, 3, 4], [1, 2, 3, 4], np.arange(1, 17), max_bars=4)
+
+
+class TestDictOutput:
+    """Test the output='dict' mode skipping plotly validation"""
+
+    @pytest.mark.parametrize(
+        'x, y, z, kwargs',
+        [
+            ([1, 1, 2, 2], [10, 20, 10, 20], [1, 2, 3, 4], dict(color='x+y')),
+            ([2, 3, 5, 10, 20], [31, 24, 10, 28, 48], [0.97, 0.99, 0.99, 0.9995, 0.9995], dict(title='Paired')),
+            ([1, 10], [2, 4], [10, np.nan, 20, 45], dict(merge_traces=True, x_title='X')),
+            ([1, 2, 3, 4], [1, 2, 3, 4], np.arange(1, 17), dict(max_bars=4)),
+            ([1, 1, 2, 2], [10, 20, 10, 20], [1, 2, 3, 4], dict(color='z', merge_traces=True)),
+        ],
+    )
+    def test_dict_matches_validated_figure(self, x, y, z, kwargs):
+        """Test that validating the plain dict gives the same figure as the default output"""
+        fig = plotly_bar_charts_3d(x, y, z, **kwargs)
+        fig_dict = plotly_bar_charts_3d(x, y, z, output='dict', **kwargs)
+
+        assert isinstance(fig_dict, dict)
+        assert all(isinstance(trace, dict) for trace in fig_dict['data'])
+        assert go.Figure(fig_dict).to_json() == fig.to_json()
+
+    def test_unknown_output(self):
+        """Test that an unknown output is rejected"""
+        with pytest.raises(ValueError):
+            plotly_bar_charts_3d([1, 2], [1, 2], [1, 2], output='html')
+
+
+class TestProfiling:
+    """Test the per-phase timing instrumentation"""
+
+    def test_phases_are_recorded(self):
+        """Test that the phases of a chart are recorded in order"""
+        records = []
+        with profile_phases(callback=records.append) as report:
+            fig = plotly_bar_charts_3d([1, 1, 2, 2], [1, 2, 1, 2], [1, 2, 3, 4], merge_traces=True)
+            to_compact_json(fig)
+
+        assert list(report.totals()) == ['detection', 'grid', 'geometry', 'traces', 'layout', 'figure', 'serialization']
+        assert records == report.records
+        assert all(record['seconds'] >= 0 and record['bytes'] is None for record in records)
+
+    def test_nested_phases_are_part_of_the_outer_phase(self):
+        """Test that grid_geometry calling box_geometry is recorded once"""
+        with profile_phases() as report:
+            grid_geometry(np.ones((3, 3)))
+
+        assert report.totals()['geometry']['calls'] == 1
+
+    def test_memory(self):
+        """Test that allocated bytes are recorded with memory=True"""
+        with profile_phases(memory=True) as report:
+            with phase('geometry'):
+                vertices = np.ones(2 ** 20)
+
+        assert report.totals()['geometry']['bytes'] >= vertices.nbytes
+
+    def test_nothing_recorded_outside(self):
+        """Test that phases outside of profile_phases are not recorded"""
+        with profile_phases() as report:
+            pass
+        plotly_bar_charts_3d([1, 2], [1, 2], [1, 2])
+
+        assert report.records == []
+
+
+class TestAnimation:
+    """Test animated charts sharing their geometry across frames"""
+
+    def test_frames_only_hold_z(self):
+        """Test that every frame holds the z coordinates of the chart of its values"""
+        x, y = [1, 1, 2, 2], [3, 4, 3, 4]
+        z_frames = [[1, 2, 3, 4], [4, 3, 2, 1], [2, 2, 2, 8]]
+
+        fig = plotly_bar_charts_3d_animation(x, y, z_frames, frame_names=['a', 'b', 'c'], color='x+y')
+
+        assert [frame.name for frame in fig.frames] == ['a', 'b', 'c']
+        assert fig.layout.scene.zaxis.range == (0.8, 8)
+        for frame, z in zip(fig.frames, z_frames):
+            expected = plotly_bar_charts_3d(x, y, z, z_min=0.8, color='x+y', merge_traces=True)
+            assert frame.traces == tuple(range(len(expected.data)))
+            for mesh, expected_mesh in zip(frame.data, expected.data):
+                assert mesh.x is None and mesh.i is None
+                np.testing.assert_array_equal(mesh.z, np.float32(expected_mesh.z))
+
+    def test_frames_hold_intensity(self):
+        """Test that frames colored by height hold the intensity and share the range of every frame"""
+        fig = plotly_bar_charts_3d_animation([1, 2], [3, 4], [[1, 2], [4, 3]], color='z')
+
+        assert (fig.data[0].cmin, fig.data[0].cmax) == (1, 4)
+        np.testing.assert_array_equal(fig.frames[1].data[0].intensity, np.repeat([4, 3], 8))
+
+    def test_frame_names(self):
+        """Test that there must be one name per frame"""
+        with pytest.raises(ValueError):
+            plotly_bar_charts_3d_animation([1, 2], [1, 2], [[1, 2], [2, 1]], frame_names=['a'])
+
+
+class TestCompactJson:
+    """Test the serialization with typed arrays"""
+
+    def test_mesh_arrays_are_typed(self):
+        """Test that coordinates are float32 and indices small unsigned integers"""
+        fig = plotly_bar_charts_3d([1, 10], [2, 4], [10.5, 30, 20, 45], merge_traces=True)
+
+        fig_dict = json.loads(to_compact_json(fig))
+        for trace, mesh in zip(fig_dict['data'], fig.data):
+            assert trace['x']['dtype'] == 'f4'
+            assert trace['i']['dtype'] == 'u1'
+            np.testing.assert_array_equal(decode_typed_array(trace['z']), np.float32(mesh.z))
+            np.testing.assert_array_equal(decode_typed_array(trace['k']), mesh.k)
+        assert fig_dict['layout']['scene']['xaxis']['ticktext'] == ['1', '10']
+
+    def test_dict_figure(self):
+        """Test that a dict figure gives the same compact JSON as its validated figure and is not modified"""
+        fig_dict = plotly_bar_charts_3d([1, 10], [2, 4], [10.5, 30, 20, 45], merge_traces=True, output='dict')
+        x = fig_dict['data'][0]['x']
+
+        compact = json.loads(to_compact_json(fig_dict))
+        expected = json.loads(to_compact_json(go.Figure(fig_dict)))
+        assert compact['data'] == expected['data']
+        assert compact['layout']['template'] == expected['layout']['template']
+        assert fig_dict['data'][0]['x'] is x
+
+    def test_compact_json_is_smaller(self):
+        """Test that the compact serialization is smaller than fig.to_json()"""
+        x = np.repeat(np.arange(20), 20)
+        y = np.tile(np.arange(20), 20)
+        z = np.arange(400) / 7
+
+        saving = compact_json_saving(plotly_bar_charts_3d(x, y, z, merge_traces=True))
+
+        assert saving['compact_bytes'] < saving['json_bytes']
+        assert saving['ratio'] > 1
+
+
+class TestFigureCache:
+    """Test the LRU cache of charts"""
+
+    def test_content_hash(self):
+        """Test that the hash depends on the content and the options, not on the container"""
+        assert content_hash([1, 2], [3, 4], [5, 6]) == content_hash(np.array([1, 2]), (3, 4), pd.Series([5, 6]))
+        assert content_hash([1, 2], [3, 4], [5, 6]) != content_hash([1, 2], [3, 4], [5, 7])
+        assert content_hash([1, 2], [3, 4], [5, 6], color='x') != content_hash([1, 2], [3, 4], [5, 6], color='y')
+        assert content_hash(['a', None], [3, 4], [5, 6]) != content_hash(['b', None], [3, 4], [5, 6])
+        legend = np.arange(2000)
+        assert content_hash([1], [2], [3], x_legend=legend) != content_hash([1], [2], [3], x_legend=legend[::-1])
+        assert content_hash([1], [2], [3], x_legend=legend) == content_hash([1], [2], [3], x_legend=legend.copy())
+
+    def test_rewritten_npy_file(self, tmp_path):
+        """Test that a .npy file written again with other values is another chart"""
+        cache = FigureCache()
+        path = tmp_path / 'grid.npy'
+        np.save(path, np.ones((2, 2)))
+        first = cache.figure(None, None, path)
+
+        np.save(path, np.full((2, 3), 2.0))
+        os.utime(path, ns=(0, path.stat().st_mtime_ns + 1))
+        second = cache.figure(None, None, str(path))
+
+        assert second is not first
+        assert len(second.data) == 6
+
+    def test_dataframe_labels(self):
+        """Test that pivoted DataFrames with the same values but other labels are different charts"""
+        cache = FigureCache()
+        values = np.arange(1.0, 5.0).reshape(2, 2)
+
+        first = cache.figure(None, None, pd.DataFrame(values, index=[1, 2], columns=['a', 'b']))
+        second = cache.figure(None, None, pd.DataFrame(values, index=[1, 2], columns=['c', 'd']))
+
+        assert second is not first
+        assert second.layout.scene.xaxis.ticktext == ('c', 'd')
+
+    def test_dict_output(self):
+        """Test that dict figures are cached, weighed and serialized"""
+        cache = FigureCache()
+
+        fig_dict = cache.figure([1, 2], [3, 4], [5, 6], output='dict')
+        json_str = cache.json([1, 2], [3, 4], [5, 6], output='dict')
+
+        assert cache.figure([1, 2], [3, 4], [5, 6], output='dict') is fig_dict
+        assert cache.stats['bytes'] == figure_nbytes(fig_dict) + len(json_str) > len(json_str)
+        assert json.loads(json_str)['data'][1]['z'] == [4, 4, 4, 4, 6, 6, 6, 6]
+
+    def test_return_bars_raises(self):
+        """Test that return_bars is refused, the cache only holds figures"""
+        with pytest.raises(ValueError, match='return_bars'):
+            FigureCache().figure([1, 2], [3, 4], [5, 6], return_bars=True)
+        with pytest.raises(ValueError, match='return_bars'):
+            FigureCache().json([1, 2], [3, 4], [5, 6], return_bars=True)
+
+    def test_hits_and_misses(self):
+        """Test that a second request with the same data and options is served from the cache"""
+        cache = FigureCache()
+
+        fig = cache.figure([1, 2], [3, 4], [5, 6], color='y')
+        assert cache.figure([1, 2], [3, 4], [5, 6], color='y') is fig
+        json_str = cache.json([1, 2], [3, 4], [5, 6], color='y')
+        assert cache.json([1, 2], [3, 4], [5, 6], color='y') == json_str == fig.to_json()
+        cache.figure([1, 2], [3, 4], [5, 6], color='x')
+
+        stats = cache.stats
+        assert (stats['hits'], stats['misses'], stats['entries']) == (2, 3, 3)
+        assert stats['hit_rate'] == 0.4
+
+    def test_eviction(self):
+        """Test that the least recently used entries are evicted"""
+        cache = FigureCache(max_entries=2)
+
+        cache.json([1], [1], [1])
+        cache.json([2], [2], [2])
+        cache.json([1], [1], [1])
+        cache.json([3], [3], [3])
+
+        assert cache.stats['evictions'] == 1
+        cache.json([1], [1], [1])
+        assert cache.stats['hits'] == 2
+
+    def test_byte_bound(self):
+        """Test that entries bigger than the memory bound are not kept"""
+        cache = FigureCache(max_bytes=100)
+
+        cache.json([1, 2], [3, 4], [5, 6])
+
+        assert cache.stats['entries'] == 0
+        assert cache.stats['bytes'] == 0
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor counting the submitted calls"""
+
+    def __init__(self):
+        super().__init__(max_workers=4)
+        self.submitted = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(fn, *args, **kwargs)
+
+
+class TestBuildFigureJson:
+    """Test the asynchronous build of figures coalescing identical requests"""
+
+    def test_identical_requests_are_coalesced(self):
+        """Test that concurrent identical requests share a single build"""
+        x, y, z = [1, 1, 2, 2], [3, 4, 3, 4], [1, 2, 3, 4]
+
+        async def requests(executor):
+            return await asyncio.gather(
+                *(build_figure_json(x, y, z, executor=executor, merge_traces=True) for _ in range(10)),
+                build_figure_json(x, y, z, executor=executor, color='y'),
+                build_figure_json(x, y, z, compact=True, executor=executor, merge_traces=True),
+            )
+
+        with CountingExecutor() as executor:
+            results = asyncio.run(requests(executor))
+
+        assert executor.submitted == 3
+        assert set(results[:10]) == {figure_json(x, y, z, merge_traces=True)}
+        assert results[10] == figure_json(x, y, z, color='y')
+        assert results[11] == figure_json(x, y, z, compact=True, merge_traces=True)
+
+    def test_dict_output(self):
+        """Test that figures built with output='dict' are serialized"""
+        json_str = asyncio.run(build_figure_json([1, 2], [3, 4], [5, 6], output='dict'))
+
+        fig_dict = json.loads(json_str)
+        assert fig_dict['data'][1]['z'] == [4, 4, 4, 4, 6, 6, 6, 6]
+        assert fig_dict['layout']['template'] == json.loads(figure_json([1, 2], [3, 4], [5, 6]))['layout']['template']
+
+    def test_event_loop_is_not_blocked(self):
+        """Test that the event loop runs while a figure is built"""
+        release = threading.Event()
+
+        class WaitingExecutor(ThreadPoolExecutor):
+            def submit(self, fn, /, *args, **kwargs):
+                return super().submit(lambda: release.wait(5) and fn(*args, **kwargs))
+
+        async def request(executor):
+            build = asyncio.ensure_future(build_figure_json([1, 2], [3, 4], [1, 2], executor=executor))
+            await asyncio.sleep(0.01)
+            assert not build.done()
+            release.set()
+            return await build
+
+        with WaitingExecutor(max_workers=1) as executor:
+            assert json.loads(asyncio.run(request(executor)))['data']
+
+    def test_cache(self):
+        """Test that sequential requests are served by the cache"""
+        cache = FigureCache()
+
+        async def requests():
+            return [await build_figure_json([1, 2], [3, 4], [1, 2], cache=cache) for _ in range(3)]
+
+        assert len(set(asyncio.run(requests()))) == 1
+        assert cache.stats['hits'] == 2
+
+
+class TestRenderMany:
+    """Test the parallel rendering of many charts"""
+
+    def test_files_and_timings(self, tmp_path):
+        """Test that every chart is written and timed, in the order of the specs"""
+        specs = [
+            dict(name='grid', x=[1, 1, 2, 2], y=[3, 4, 3, 4], z=[1, 2, 3, 4], options=dict(color='y')),
+            dict(x=[1, 2, 3], y=[4, 5, 6], z=[10, 20, 30], format='json'),
+            dict(x=[1, 2, 3], y=[4, 5, 6], z=[10, 20, 30], format='compact_json'),
+        ]
+
+        timings = render_many(specs, tmp_path / 'charts', workers=2)
+
+        assert [timing['name'] for timing in timings] == ['grid', 'chart_1', 'chart_2']
+        assert [Path(timing['path']).name for timing in timings] == ['grid.html', 'chart_1.json', 'chart_2.json']
+        for timing in timings:
+            assert Path(timing['path']).stat().st_size == timing['bytes'] > 0
+            assert timing['build_s'] >= 0
+            assert timing['write_s'] >= 0
+        fig_dict = json.loads(Path(timings[1]['path']).read_text())
+        assert len(fig_dict['data']) == 3
+
+    @pytest.mark.parametrize('file_format', ['html', 'json', 'compact_json'])
+    def test_dict_output(self, tmp_path, file_format):
+        """Test that charts built with output='dict' are written"""
+        specs = [dict(x=[1, 2, 3], y=[4, 5, 6], z=[10, 20, 30], format=file_format, options=dict(output='dict'))]
+
+        timings = render_many(specs, tmp_path, workers=1)
+
+        assert timings[0]['bytes'] > 0
+
+
 class TestEdgeCases:
     """Test edge cases and special scenarios"""
 
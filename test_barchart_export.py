@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import json
+import re
+
+import plotly.io as pio
+import pytest
+
+from barchart import plotly_bar_charts_3d
+from barchart import to_compact_json
+from barchart_export import ImageExporter
+from barchart_export import plotlyjs_gl3d_url
+from barchart_export import to_lean_html
+from barchart_export import write_lean_html
+
+
+@pytest.fixture(scope='module')
+def exporter():
+    """Running ImageExporter, tests are skipped without kaleido or Chrome"""
+    chromium = pytest.importorskip('choreographer.browsers.chromium')
+    if chromium.Chromium.find_browser(skip_local=False) is None:
+        pytest.skip('Chrome is not installed, run plotly_get_chrome')
+    image_exporter = ImageExporter(tabs=2)
+    try:
+        image_exporter.start()
+        pio.to_image(plotly_bar_charts_3d([1], [1], [1]), format='png')
+    except Exception as error:
+        image_exporter.stop()
+        pytest.skip(f'kaleido cannot render images: {error}')
+    yield image_exporter
+    image_exporter.stop()
+
+
+class TestBatches:
+    """Test that figures are sent to kaleido by batches"""
+
+    def test_charts_are_batched(self, tmp_path, monkeypatch):
+        """Test that charts are built with merged traces and written by batches, in the order of the specs"""
+        calls = []
+        monkeypatch.setattr(pio, 'write_images', lambda figures, paths, **kwargs: calls.append((figures, paths)))
+        specs = [dict(x=[1, 1, 2, 2], y=[3, 4, 3, 4], z=[1, 2, 3, i]) for i in range(5)]
+        specs[1]['name'] = 'second'
+
+        paths = ImageExporter(batch_size=2).write_charts(specs, tmp_path, image_format='svg')
+
+        assert [len(figures) for figures, _ in calls] == [2, 2, 1]
+        assert [path for _, batch_paths in calls for path in batch_paths] == paths
+        assert [path.rsplit('/', 1)[-1] for path in paths[:3]] == ['chart_0.svg', 'second.svg', 'chart_2.svg']
+        assert len(calls[0][0][0].data) == 2
+
+    def test_one_path_per_figure(self):
+        """Test that figures and paths must have the same length"""
+        with pytest.raises(ValueError):
+            ImageExporter().write_images([plotly_bar_charts_3d([1], [1], [1])], [])
+
+
+class TestImages:
+    """Test images rendered by kaleido"""
+
+    @pytest.mark.parametrize('image_format, header', [('png', b'\x89PNG'), ('svg', b'<svg')])
+    def test_images_are_written(self, exporter, tmp_path, image_format, header):
+        """Test that every chart is written in the requested format"""
+        specs = [dict(name=f'chart_{i}', x=[1, 2], y=[3, 4], z=[1, i + 2]) for i in range(3)]
+
+        paths = exporter.write_charts(specs, tmp_path, image_format=image_format, width=200, height=200)
+
+        for path in paths:
+            with open(path, 'rb') as file:
+                assert file.read(4) == header
+
+
+class TestLeanHtml:
+    """Test the HTML pages referencing a shared plotly.js"""
+
+    def test_figures_are_embedded_as_typed_arrays(self):
+        """Test that every figure is embedded once with its compact JSON and plotly.js is referenced"""
+        figs = [plotly_bar_charts_3d([1, 2], [3, 4], [1, i + 2], merge_traces=True) for i in range(2)]
+
+        page = to_lean_html(figs)
+
+        assert page.count('<script src=') == 1
+        assert plotlyjs_gl3d_url() in page
+        assert 'IntersectionObserver' in page
+        embedded = re.findall(r'<script type="application/json" id="barchart3d-\d-figure">(.*?)</script>', page)
+        assert [json.loads(figure) for figure in embedded] == [json.loads(to_compact_json(fig)) for fig in figs]
+
+    def test_plotlyjs_decodes_typed_arrays(self, monkeypatch):
+        """Test that the default plotly.js is recent enough to decode typed arrays"""
+        monkeypatch.setattr('plotly.offline.get_plotlyjs_version', lambda: '2.16.1')
+        assert plotlyjs_gl3d_url() == 'https://cdn.plot.ly/plotly-gl3d-2.28.0.min.js'
+
+        monkeypatch.setattr('plotly.offline.get_plotlyjs_version', lambda: '3.1.0')
+        assert plotlyjs_gl3d_url() == 'https://cdn.plot.ly/plotly-gl3d-3.1.0.min.js'
+
+    def test_script_cannot_be_closed_by_a_title(self):
+        """Test that a title containing </script> does not end the script element"""
+        fig = plotly_bar_charts_3d([1, 2], [3, 4], [1, 2], title='</script><b>')
+
+        page = to_lean_html(fig, plotlyjs='plotly.min.js', lazy=False)
+
+        assert page.count('</script>') == 3
+        assert '<script src="plotly.min.js" defer>' in page
+
+    def test_write(self, tmp_path):
+        """Test that the page is written and its size returned"""
+        path = tmp_path / 'charts.html'
+
+        size = write_lean_html(plotly_bar_charts_3d([1, 2], [3, 4], [1, 2], x_title='Température'), path, title='Été')
+
+        assert path.read_text(encoding='utf-8').startswith('<!DOCTYPE html>')
+        assert size == len(path.read_bytes()) > len(path.read_text(encoding='utf-8'))